@@ -0,0 +1,510 @@
+# file eulcm/cache.py
+#
+#   Copyright 2012 Emory University Libraries
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+Caches for Fedora objects and information derived from them: in
+process, and (:class:`DatastreamCache`) on local disk.
+
+'''
+
+from collections import OrderedDict
+import datetime
+import hashlib
+import os
+import pickle
+from stat import S_IWGRP, S_IWOTH
+import tempfile
+import threading
+import time
+import weakref
+
+from eulfedora.util import RequestFailed
+from eulxml.xmlmap import load_xmlobject_from_string
+
+from eulcm.fetch import datastream_version, set_datastream_content, uri_to_pid
+
+
+class LRUCache(object):
+    '''Thread-safe, size-bounded cache that discards the least
+    recently used entries first, with optional expiration.
+
+    :param maxsize: maximum number of entries
+    :param ttl: optional time in seconds after which entries expire
+    '''
+
+    def __init__(self, maxsize=1000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        # does not count as a use of the entry
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and not self._expired(entry)
+
+    def _expired(self, entry):
+        return self.ttl is not None and time.time() - entry[1] > self.ttl
+
+    def get(self, key, default=None):
+        '''Get a cached value; returns the default if the key is not
+        cached or has expired.'''
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value = entry[0]
+            # expired entries are left in place for get_stale
+            if self._expired(entry):
+                return default
+            # re-insert as most recently used
+            del self._data[key]
+            self._data[key] = entry
+            return value
+
+    def get_stale(self, key, default=None):
+        '''Get a cached value even if it has expired, without updating
+        its position in the cache.'''
+        with self._lock:
+            entry = self._data.get(key)
+        return entry[0] if entry is not None else default
+
+    def set(self, key, value):
+        'Add or replace a cached value.'
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, time.time())
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        'Remove and return a cached value.'
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry is not None else default
+
+    def clear(self):
+        'Remove all cached values.'
+        with self._lock:
+            self._data.clear()
+
+    def keys(self):
+        'List of cached keys, least recently used first.'
+        with self._lock:
+            return list(self._data)
+
+
+class AccessCache(object):
+    '''Cache of :class:`~eulcm.xmlmap.boda.AccessDecision` results for
+    objects with :class:`~eulcm.xmlmap.boda.Rights` metadata (e.g.,
+    :class:`~eulcm.models.boda.Arrangement`), so that rights do not
+    need to be retrieved and evaluated for every request.
+
+    Cached decisions are used without any Fedora requests until they
+    are older than the configured ttl; after that, the ``Rights``
+    datastream profile is checked and the decision is only
+    recalculated if the datastream has changed.
+
+    :param allowed_codes: access status codes that allow access; see
+        :meth:`~eulcm.xmlmap.boda.Rights.access_decision`
+    :param maxsize: maximum number of objects to cache
+    :param ttl: number of seconds a decision is used before checking
+        for changes to the Rights datastream
+    '''
+
+    RIGHTS_DSID = 'Rights'
+
+    def __init__(self, allowed_codes, maxsize=10000, ttl=300):
+        self.allowed_codes = allowed_codes
+        self._cache = LRUCache(maxsize, ttl)
+
+    def decision(self, obj):
+        '''Get the access decision for an object.
+
+        :param obj: :class:`~eulfedora.models.DigitalObject` with a
+            ``Rights`` datastream
+        '''
+        cached = self._cache.get(obj.pid)
+        if cached is not None:
+            return cached[1]
+
+        # eulcm.xmlmap.boda is not imported at module level, since the
+        # collection models import this module for IdentityMapped
+        from eulcm.xmlmap.boda import Rights
+
+        try:
+            profile = obj.getDatastreamProfile(self.RIGHTS_DSID)
+        except RequestFailed as err:
+            if err.code != 404:
+                raise
+            profile = None
+        version = datastream_version(profile) if profile is not None else None
+
+        stale = self._cache.get_stale(obj.pid)
+        if stale is not None and stale[0] == version:
+            # rights are unchanged, but expiration depends on the date
+            decision = stale[1]
+            if decision.expiration is not None:
+                decision = decision._replace(
+                    expired=decision.expiration < datetime.date.today())
+        else:
+            rights = Rights()
+            if profile is not None:
+                data = obj.api.getDatastreamDissemination(obj.pid, self.RIGHTS_DSID).content
+                rights = load_xmlobject_from_string(data, Rights)
+            decision = rights.access_decision(self.allowed_codes)
+        self._cache.set(obj.pid, (version, decision))
+        return decision
+
+    def set(self, pid, rights, version=None):
+        '''Store the decision for rights metadata that has already been
+        loaded, e.g. when rights are updated.
+
+        :param pid: object pid
+        :param rights: :class:`~eulcm.xmlmap.boda.Rights`
+        :param version: datastream version, if known; see
+            :func:`eulcm.fetch.datastream_version`
+        '''
+        decision = rights.access_decision(self.allowed_codes)
+        self._cache.set(pid, (version, decision))
+        return decision
+
+    def invalidate(self, pid):
+        'Remove the cached decision for an object.'
+        self._cache.pop(pid)
+
+    def clear(self):
+        'Remove all cached decisions.'
+        self._cache.clear()
+
+
+_local = threading.local()
+
+def current_identity_map():
+    '''The :class:`IdentityMap` currently in use in this thread, or
+    None.'''
+    stack = getattr(_local, 'identity_maps', None)
+    return stack[-1] if stack else None
+
+
+class IdentityMap(object):
+    '''Session-scoped map of pid to
+    :class:`~eulfedora.models.DigitalObject` instance, so that related
+    objects (e.g., the :class:`~eulcm.models.collection.v1_1.Collection`
+    or :class:`~eulcm.models.boda.Mailbox` of many objects) are only
+    initialized and loaded once.  A bounded number of recently used
+    objects are held by the map, with least recently used objects
+    discarded first; beyond that, objects stay in the map for as long
+    as they are referenced elsewhere (e.g., related objects of a large
+    list loaded through a reverse relation), so that an object still
+    in use is never replaced by a second instance.
+
+    While an identity map is in use as a context manager, related
+    objects for classes that extend :class:`IdentityMapped` are taken
+    from it::
+
+        with IdentityMap():
+            for obj in arrangement_objects:
+                obj.collection      # same instance for a shared collection
+
+    Objects are shared as-is, including any unsaved changes; use one
+    map per request or unit of work with a single repository
+    connection.
+
+    :param maxsize: maximum number of objects held by the map
+    '''
+
+    def __init__(self, maxsize=1000):
+        self._cache = LRUCache(maxsize)
+        # all instances still in use, including those evicted from the
+        # lru cache
+        self._live = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._live)
+
+    def __enter__(self):
+        if getattr(_local, 'identity_maps', None) is None:
+            _local.identity_maps = []
+        _local.identity_maps.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.identity_maps.remove(self)
+
+    def get_object(self, obj, pid, type=None):
+        '''Get the instance for a pid and type, initializing it with the
+        repository connection of an existing object if it is not
+        already in the map.
+
+        :param obj: :class:`~eulfedora.models.DigitalObject` whose
+            connection is used to initialize new objects
+        :param pid: pid or object URI
+        :param type: object class; defaults to the class of ``obj``
+        '''
+        if type is None:
+            type = obj.__class__
+        key = (uri_to_pid(pid), type)
+        with self._lock:
+            instance = self._cache.get(key)
+            if instance is None:
+                instance = self._live.get(key)
+                if instance is None:
+                    instance = type(obj.api, key[0])
+                    self._live[key] = instance
+                self._cache.set(key, instance)
+        return instance
+
+    def add(self, obj):
+        'Add an existing object to the map, replacing any instance of the same type.'
+        key = (obj.pid, obj.__class__)
+        with self._lock:
+            self._live[key] = obj
+            self._cache.set(key, obj)
+
+    def invalidate(self, pid):
+        '''Remove all instances for a pid, e.g. after the object has
+        been modified elsewhere.'''
+        pid = uri_to_pid(pid)
+        with self._lock:
+            for key in list(self._live.keys()):
+                if key[0] == pid:
+                    self._live.pop(key, None)
+            for key in self._cache.keys():
+                if key[0] == pid:
+                    self._cache.pop(key)
+
+    def clear(self):
+        'Remove all objects from the map.'
+        with self._lock:
+            self._live.clear()
+            self._cache.clear()
+
+
+class IdentityMapped(object):
+    '''Mixin for :class:`~eulfedora.models.DigitalObject` classes: while
+    an :class:`IdentityMap` is in use, related objects initialized
+    through :meth:`get_object` (including
+    :class:`~eulfedora.models.Relation` attributes) are taken from the
+    identity map.'''
+
+    def get_object(self, pid, type=None):
+        identity_map = current_identity_map()
+        if identity_map is not None:
+            return identity_map.get_object(self, pid, type)
+        return super(IdentityMapped, self).get_object(pid, type)
+
+
+def _check_private(directory):
+    # raise ValueError if other users could write to a directory; file
+    # ownership and permission bits are only meaningful on posix
+    if not hasattr(os, 'getuid'):
+        return
+    info = os.stat(directory)
+    if info.st_uid != os.getuid():
+        raise ValueError('cache directory %s is not owned by the current user'
+                         % directory)
+    if info.st_mode & (S_IWGRP | S_IWOTH):
+        raise ValueError('cache directory %s is writable by other users'
+                         % directory)
+
+
+class DatastreamCache(object):
+    '''Read-through, on-disk cache of datastream content, for xml
+    datastreams that change rarely (e.g., ``Rights``, ``MODS``,
+    ``FileMasterTech``).  Content is stored by pid, datastream id and
+    datastream version (see :func:`eulcm.fetch.datastream_version`),
+    so freshness is checked with a datastream profile request instead
+    of downloading the content.  Values calculated from the parsed
+    xml can also be cached, pickled, to skip parsing as well; see
+    :meth:`get_value`.
+
+    The cache directory is bounded in size; the least recently used
+    files are removed first.  Multiple processes run by the same user
+    may share a cache directory, although each only tracks the size of
+    the files it has seen.  Since cached values are unpickled, the
+    directory must be owned by the current user and not writable by
+    anyone else; a :class:`ValueError` is raised otherwise.
+
+    :param directory: cache directory; created (readable only by the
+        current user) if it does not exist
+    :param maxsize: maximum total size of cached files, in bytes
+    '''
+
+    def __init__(self, directory, maxsize=100 * 1024 * 1024):
+        self.directory = directory
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        _check_private(directory)
+        # filename -> size, least recently used first
+        self._files = OrderedDict()
+        self.size = 0
+        'total size of cached files, in bytes'
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith('.tmp'):
+                continue
+            stat = os.stat(os.path.join(directory, name))
+            entries.append((stat.st_mtime, name, stat.st_size))
+        for mtime, name, size in sorted(entries):
+            self._files[name] = size
+            self.size += size
+
+    def __len__(self):
+        return len(self._files)
+
+    def _filename(self, pid, dsid, version, suffix):
+        key = '%s\0%s\0%s' % (pid, dsid, version)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest() + suffix
+
+    def _read(self, name):
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, 'rb') as cached:
+                data = cached.read()
+        except (IOError, OSError):
+            with self._lock:
+                size = self._files.pop(name, None)
+                if size is not None:
+                    self.size -= size
+            return None
+        with self._lock:
+            if name in self._files:
+                self._files[name] = self._files.pop(name)
+        try:
+            # update the modification time to keep lru order on disk
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+
+    def _write(self, name, data):
+        handle, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as tmpfile:
+            tmpfile.write(data)
+        os.replace(tmp, os.path.join(self.directory, name))
+        with self._lock:
+            self.size -= self._files.pop(name, 0)
+            self._files[name] = len(data)
+            self.size += len(data)
+            while self.size > self.maxsize and len(self._files) > 1:
+                old, size = self._files.popitem(last=False)
+                self.size -= size
+                try:
+                    os.remove(os.path.join(self.directory, old))
+                except OSError:
+                    pass
+
+    def _version(self, obj, dsid):
+        # current datastream version from the profile, or None if the
+        # datastream does not exist
+        try:
+            profile = obj.getDatastreamProfile(dsid)
+        except RequestFailed as err:
+            if err.code != 404:
+                raise
+            return None
+        return datastream_version(profile)
+
+    def get_content(self, obj, dsid):
+        '''Get the current content of a datastream, as bytes, from the
+        cache if it is current or from Fedora if not.  Returns None if
+        the datastream does not exist.
+
+        :param obj: :class:`~eulfedora.models.DigitalObject`
+        :param dsid: datastream id
+        '''
+        return self._content(obj, dsid, self._version(obj, dsid))
+
+    def _content(self, obj, dsid, version):
+        if version is None:
+            return None
+        name = self._filename(obj.pid, dsid, version, '.xml')
+        data = self._read(name)
+        if data is None:
+            data = obj.api.getDatastreamDissemination(obj.pid, dsid).content
+            self._write(name, data)
+        return data
+
+    def get_xml(self, obj, dsid, xmlclass):
+        '''Get the current content of an xml datastream, parsed as an
+        :class:`~eulxml.xmlmap.XmlObject`; see :meth:`get_content`.
+        Returns an empty instance if the datastream does not exist.'''
+        data = self.get_content(obj, dsid)
+        if data is None:
+            return xmlclass()
+        return load_xmlobject_from_string(data, xmlclass)
+
+    def get_value(self, obj, dsid, xmlclass, func):
+        '''Get a value calculated from the parsed content of an xml
+        datastream (e.g., :meth:`~eulcm.xmlmap.boda.FileMasterTech.file_records`
+        or an :class:`~eulcm.xmlmap.boda.AccessDecision`).  Values are
+        pickled and cached along with the content, so that when the
+        datastream is unchanged, neither content nor parsing is needed.
+
+        :param obj: :class:`~eulfedora.models.DigitalObject`
+        :param dsid: datastream id
+        :param xmlclass: :class:`~eulxml.xmlmap.XmlObject` class to
+            parse the content as
+        :param func: function called with the parsed xml; must be a
+            module-level function and return a picklable value
+        '''
+        version = self._version(obj, dsid)
+        funcname = '%s.%s' % (func.__module__, getattr(func, '__qualname__', func.__name__))
+        name = self._filename(obj.pid, dsid, version, '.%s.pickle' %
+                              hashlib.sha1(funcname.encode('utf-8')).hexdigest()[:12])
+        data = self._read(name) if version is not None else None
+        if data is not None:
+            try:
+                return pickle.loads(data)
+            except Exception:
+                # unreadable (e.g., pickled by a different version of
+                # the code); recalculate
+                pass
+        content = self._content(obj, dsid, version)
+        if content is None:
+            xml = xmlclass()
+        else:
+            xml = load_xmlobject_from_string(content, xmlclass)
+        value = func(xml)
+        if version is not None:
+            self._write(name, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        return value
+
+    def load(self, ds):
+        '''Populate a :class:`~eulfedora.models.DatastreamObject` (e.g.
+        ``obj.rights``) from the cache, so that accessing its content
+        does not request it from Fedora.'''
+        set_datastream_content(ds, self.get_content(ds.obj, ds.id))
+        return ds
+
+    def clear(self):
+        'Remove all cached files.'
+        with self._lock:
+            for name in self._files:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+            self._files.clear()
+            self.size = 0
@@ -0,0 +1,211 @@
+# file eulcm/fetch.py
+#
+#   Copyright 2012 Emory University Libraries
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+Utilities for retrieving content for many Fedora objects at once,
+using a bounded pool of threads that share the connection pool of a
+single :class:`eulfedora.api.REST_API`.
+
+'''
+
+from itertools import islice
+
+from eulfedora.util import RequestFailed, parse_xml_object
+from eulfedora.xml import DatastreamProfile
+
+
+DEFAULT_WORKERS = 8
+'default number of concurrent requests'
+
+FEDORA_LABEL = 'info:fedora/fedora-system:def/model#label'
+'fedora object label property, as indexed in the Resource Index'
+
+
+def uri_to_pid(uri):
+    '''Convert a Fedora object URI (e.g., from a Resource Index query
+    result) to a pid.'''
+    uri = '%s' % uri
+    if uri.startswith('info:fedora/'):
+        return uri[len('info:fedora/'):]
+    return uri
+
+
+def datastream_version(ds):
+    '''Identifier for the current version of a
+    :class:`~eulfedora.models.DatastreamObject` (or a
+    :class:`~eulfedora.xml.DatastreamProfile`), based on the
+    checksum from the datastream profile, or the datastream creation
+    date if checksums are not enabled.  Returns None for datastreams
+    that do not exist in Fedora.'''
+    if not getattr(ds, 'exists', True):
+        return None
+    checksum = ds.checksum
+    if checksum and checksum != 'none':
+        return checksum
+    return str(ds.created)
+
+
+def run_concurrently(func, items, workers=DEFAULT_WORKERS):
+    '''Call a function on each item in a list using a bounded pool of
+    threads, and return the results in the same order as the items.
+
+    :param func: function to call with a single item
+    :param items: list of items
+    :param workers: maximum number of concurrent calls
+    '''
+    # eulfedora does not import concurrent.futures; deferring it keeps
+    # about 4ms off importing the collection models, which import
+    # this module by way of eulcm.cache
+    from concurrent.futures import ThreadPoolExecutor
+
+    items = list(items)
+    if not items:
+        return []
+    with ThreadPoolExecutor(max(1, min(workers, len(items)))) as executor:
+        return list(executor.map(func, items))
+
+
+def iter_concurrently(func, items, workers=DEFAULT_WORKERS):
+    '''Generator version of :func:`run_concurrently`: calls a function
+    on each item using a bounded pool of threads, and yields results as
+    they complete (not necessarily in the same order as the items).
+    Items are taken from the iterable only as workers become free, so
+    at most ``workers`` items are in progress at a time and large or
+    incrementally parsed inputs are not read ahead.
+
+    :param func: function to call with a single item
+    :param items: iterable of items
+    :param workers: maximum number of concurrent calls
+    '''
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    workers = max(1, workers)
+    items = iter(items)
+    executor = ThreadPoolExecutor(workers)
+    pending = set()
+    try:
+        for item in islice(items, workers):
+            pending.add(executor.submit(func, item))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            # replace completed items before yielding, so that workers
+            # are not idle while the caller handles results
+            for item in islice(items, workers - len(pending)):
+                pending.add(executor.submit(func, item))
+            for future in done:
+                yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def fetch_datastreams(api, pids, dsids, workers=DEFAULT_WORKERS):
+    '''Retrieve datastream content for a list of objects concurrently.
+
+    :param api: :class:`eulfedora.api.REST_API` instance
+    :param pids: list of object pids
+    :param dsids: list of datastream ids to retrieve for each object
+    :param workers: maximum number of concurrent requests
+    :returns: dictionary of (pid, dsid) -> datastream content, as
+        bytes; content is None for datastreams that do not exist
+    '''
+    def fetch(key):
+        pid, dsid = key
+        try:
+            return key, api.getDatastreamDissemination(pid, dsid).content
+        except RequestFailed as err:
+            if err.code == 404:
+                return key, None
+            raise
+
+    keys = [(pid, dsid) for pid in pids for dsid in dsids]
+    return dict(run_concurrently(fetch, keys, workers))
+
+
+def fetch_profiles(api, pids, dsid, workers=DEFAULT_WORKERS):
+    '''Retrieve the profile of a datastream for a list of objects
+    concurrently, e.g. to check datastream versions (see
+    :func:`datastream_version`) without retrieving content.
+
+    :param api: :class:`eulfedora.api.REST_API` instance
+    :param pids: list of object pids
+    :param dsid: datastream id
+    :param workers: maximum number of concurrent requests
+    :returns: dictionary of pid ->
+        :class:`~eulfedora.xml.DatastreamProfile`; the profile is None
+        for objects where the datastream does not exist
+    '''
+    def fetch(pid):
+        try:
+            r = api.getDatastream(pid, dsid)
+        except RequestFailed as err:
+            if err.code == 404:
+                return pid, None
+            raise
+        return pid, parse_xml_object(DatastreamProfile, r.content, r.url)
+
+    return dict(run_concurrently(fetch, pids, workers))
+
+
+def set_datastream_content(ds, data):
+    '''Populate a :class:`~eulfedora.models.DatastreamObject` with
+    content that has already been retrieved (e.g., by
+    :func:`fetch_datastreams`), as if it had been loaded on first
+    access.  Content of None is treated as a datastream that does not
+    exist, and the default content is used.'''
+    if data is None:
+        ds._content = ds._bootstrap_content()
+    else:
+        ds._content = ds._convert_content(data, None)
+        ds.digest = ds._content_digest()
+
+
+def prefetch_objects(repo, pids, type, datastreams, workers=DEFAULT_WORKERS):
+    '''Initialize a list of objects and load the content of the
+    specified datastreams for all of them with concurrent requests,
+    rather than one request per object and datastream as they are
+    accessed.
+
+    :param repo: :class:`eulfedora.server.Repository`
+    :param pids: list of pids
+    :param type: :class:`~eulfedora.models.DigitalObject` subclass
+    :param datastreams: list of datastream attribute names defined on
+        the class (e.g., ``['rights', 'mods']``)
+    :param workers: maximum number of concurrent requests
+    :returns: list of objects, in the same order as the pids
+    '''
+    objects = [repo.get_object(uri_to_pid(pid), type=type) for pid in pids]
+    dsids = dict((name, type._defined_datastreams[name].id) for name in datastreams)
+
+    # datastream objects check the object's datastream list when
+    # initialized; load the lists concurrently, then only request
+    # datastreams that exist
+    def datastream_list(obj):
+        return obj.ds_list
+    run_concurrently(datastream_list, objects, workers)
+    keys = [(obj.pid, dsid) for obj in objects for dsid in dsids.values()
+            if dsid in obj.ds_list]
+
+    def fetch(key):
+        return key, api.getDatastreamDissemination(*key).content
+    api = repo.api
+    content = dict(run_concurrently(fetch, keys, workers))
+
+    for obj in objects:
+        for name, dsid in dsids.items():
+            set_datastream_content(getattr(obj, name), content.get((obj.pid, dsid)))
+    return objects
@@ -0,0 +1,179 @@
+# file eulcm/fixity.py
+#
+#   Copyright 2012 Emory University Libraries
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+Fixity verification for :class:`~eulcm.models.boda.RushdieFile`
+objects: the content of the ``ORIGINAL`` datastream is streamed from
+Fedora in fixed-size chunks and its MD5 checksum is compared with the
+checksum recorded in the ``FileMasterTech`` datastream.
+
+Results can be written to a :class:`FixityReport`, which also serves
+as a checkpoint: objects already in the report are skipped when an
+interrupted audit is restarted.
+
+'''
+
+from collections import namedtuple
+import hashlib
+from io import BytesIO
+
+from eulfedora.util import RequestFailed
+
+from eulcm.fetch import DEFAULT_WORKERS, iter_concurrently, uri_to_pid
+from eulcm.report import CsvReport
+from eulcm.xmlmap.boda import FileMasterTech
+
+
+CHUNK_SIZE = 1024 * 1024
+'default number of bytes read from Fedora at a time'
+
+ORIGINAL_DSID = 'ORIGINAL'
+FILETECH_DSID = 'FileMasterTech'
+
+# fixity check statuses
+OK = 'ok'
+MISMATCH = 'mismatch'
+NO_CHECKSUM = 'no checksum'
+NO_CONTENT = 'no content'
+ERROR = 'error'
+
+FixityResult = namedtuple('FixityResult', ['pid', 'status', 'expected',
+                                           'actual', 'error'])
+'''Result of a fixity check: pid, status (one of :data:`OK`,
+:data:`MISMATCH`, :data:`NO_CHECKSUM`, :data:`NO_CONTENT`, or
+:data:`ERROR`), expected and actual MD5 checksums, and error
+message.'''
+
+
+def stream_md5(api, pid, dsid=ORIGINAL_DSID, chunk_size=CHUNK_SIZE):
+    '''Calculate the MD5 checksum of a datastream, reading the
+    content from Fedora in chunks rather than loading it into memory.
+
+    :param api: :class:`eulfedora.api.REST_API` instance
+    :param pid: object pid
+    :param dsid: datastream id
+    :param chunk_size: number of bytes to read at a time
+    '''
+    md5 = hashlib.md5()
+    r = api.getDatastreamDissemination(pid, dsid, stream=True)
+    try:
+        for chunk in r.iter_content(chunk_size):
+            md5.update(chunk)
+    finally:
+        r.close()
+    return md5.hexdigest()
+
+
+def expected_md5(data):
+    '''MD5 checksum for the first file described in FileMasterTech xml
+    content, or None.'''
+    for f in FileMasterTech.iterfiles(BytesIO(data), records=True):
+        return (f.md5 or '').strip().lower() or None
+
+
+def check_fixity(api, pid, chunk_size=CHUNK_SIZE):
+    '''Compare the checksum of the ``ORIGINAL`` datastream for a
+    single object with the MD5 in its ``FileMasterTech`` datastream.
+    Errors are captured in the result rather than raised.
+
+    :param api: :class:`eulfedora.api.REST_API` instance
+    :param pid: object pid
+    :param chunk_size: number of bytes to read at a time
+    :returns: :class:`FixityResult`
+    '''
+    expected = None
+    try:
+        try:
+            data = api.getDatastreamDissemination(pid, FILETECH_DSID).content
+        except RequestFailed as err:
+            if err.code != 404:
+                raise
+            data = None
+        if data:
+            expected = expected_md5(data)
+        if expected is None:
+            return FixityResult(pid, NO_CHECKSUM, None, None, None)
+
+        try:
+            actual = stream_md5(api, pid, ORIGINAL_DSID, chunk_size)
+        except RequestFailed as err:
+            if err.code != 404:
+                raise
+            return FixityResult(pid, NO_CONTENT, expected, None, None)
+
+        status = OK if actual == expected else MISMATCH
+        return FixityResult(pid, status, expected, actual, None)
+    except Exception as err:
+        return FixityResult(pid, ERROR, expected, None,
+                            '%s: %s' % (err.__class__.__name__, err))
+
+
+class FixityReport(CsvReport):
+    '''Fixity results stored in a CSV file, one row per check; see
+    :class:`~eulcm.report.CsvReport`.  Objects whose check failed with
+    an error are checked again when an audit is resumed.
+
+    :param filename: report file; created if it does not exist
+    '''
+
+    RESULT = FixityResult
+
+    def __init__(self, filename):
+        self.checked = set()
+        'set of pids already checked (without errors)'
+        super(FixityReport, self).__init__(filename)
+
+    def _update(self, result):
+        if result.status != ERROR:
+            self.checked.add(result.pid)
+
+    def problems(self):
+        '''List of :class:`FixityResult` with a status other than OK,
+        using the most recent result for each object.'''
+        latest = {}
+        for result in self.results():
+            latest.pop(result.pid, None)
+            latest[result.pid] = result
+        return [result for result in latest.values() if result.status != OK]
+
+
+def verify_fixity(api, pids, report=None, workers=DEFAULT_WORKERS,
+                  chunk_size=CHUNK_SIZE, progress=None):
+    '''Check fixity for a list of objects with a bounded pool of
+    worker threads; see :func:`check_fixity`.  Generator returning
+    :class:`FixityResult` as checks complete.
+
+    :param api: :class:`eulfedora.api.REST_API` instance
+    :param pids: iterable of object pids
+    :param report: optional :class:`FixityReport`; objects already in
+        the report are skipped, and new results are recorded
+    :param workers: maximum number of concurrent checks
+    :param chunk_size: number of bytes to read at a time
+    :param progress: optional callback, called with each result
+    '''
+    pids = (uri_to_pid(pid) for pid in pids)
+    if report is not None:
+        pids = (pid for pid in pids if pid not in report.checked)
+
+    def check(pid):
+        return check_fixity(api, pid, chunk_size)
+
+    for result in iter_concurrently(check, pids, workers):
+        if report is not None:
+            report.record(result)
+        if progress is not None:
+            progress(result)
+        yield result
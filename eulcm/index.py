@@ -0,0 +1,591 @@
+# file eulcm/index.py
+#
+#   Copyright 2012 Emory University Libraries
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+Local, persistent lookup indexes built from eulcm object datastreams,
+stored in `SQLite <http://www.sqlite.org/>`_ databases.
+
+Indexes are updated incrementally: each indexed object is stored
+along with the version of the datastream it was indexed from, and
+objects whose datastream has not changed are skipped on update.
+
+'''
+
+from collections import namedtuple
+import datetime
+import json
+import sqlite3
+import threading
+
+from eulxml.xmlmap import load_xmlobject_from_string
+
+from eulcm.fetch import DEFAULT_WORKERS, datastream_version, fetch_datastreams, \
+     fetch_profiles
+from eulcm.models.boda import Arrangement
+from eulcm.xmlmap.boda import ArrangementMods, SeriesKey, parse_w3cdtf
+from eulcm.xmlmap.mods import MODS
+
+
+class _SqliteIndex(object):
+    # common database handling for sqlite-based indexes; subclasses
+    # should define SCHEMA, which must include a ``sources`` table
+    # with pid and version columns
+
+    SCHEMA = None
+
+    def __init__(self, filename=':memory:', check_same_thread=True):
+        self.filename = filename
+        self.db = sqlite3.connect(filename, check_same_thread=check_same_thread)
+        self.db.executescript(self.SCHEMA)
+
+    def close(self):
+        'Close the database connection.'
+        self.db.close()
+
+    def indexed_version(self, pid):
+        '''Datastream version last indexed for the specified pid, or
+        None if the object has not been indexed.'''
+        row = self.db.execute('SELECT version FROM sources WHERE pid = ?',
+                              (pid,)).fetchone()
+        if row is not None:
+            return row[0]
+
+    def needs_update(self, pid, version):
+        '''Check if an object needs to be (re)indexed, i.e. it has
+        not been indexed or was indexed from a different datastream
+        version.'''
+        return version is None or self.indexed_version(pid) != version
+
+    def update(self, objects):
+        '''Index a list of objects; see :meth:`add_object`.  Returns
+        the number of objects that were indexed.'''
+        return len([obj for obj in objects if self.add_object(obj)])
+
+    def _set_version(self, pid, version):
+        self.db.execute('INSERT OR REPLACE INTO sources (pid, version) VALUES (?, ?)',
+                        (pid, version))
+
+
+FileLocation = namedtuple('FileLocation', ['pid', 'path', 'computer'])
+'Location of a file in an :class:`Md5Index`: pid, path, and computer.'
+
+
+class Md5Index(_SqliteIndex):
+    '''Index of file MD5 checksums from
+    :class:`~eulcm.xmlmap.boda.FileMasterTech` metadata, for finding
+    duplicate files across :class:`~eulcm.models.boda.Arrangement`
+    objects.
+
+    :param filename: sqlite database file; defaults to an in-memory
+        database
+    '''
+
+    SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS sources (
+        pid TEXT PRIMARY KEY,
+        version TEXT
+    );
+    CREATE TABLE IF NOT EXISTS files (
+        md5 TEXT NOT NULL,
+        pid TEXT NOT NULL,
+        path TEXT,
+        computer TEXT
+    );
+    CREATE INDEX IF NOT EXISTS files_md5 ON files (md5);
+    CREATE INDEX IF NOT EXISTS files_pid ON files (pid);
+    '''
+
+    def add(self, pid, files, version=None):
+        '''Add or replace the files for a single object.
+
+        :param pid: object pid
+        :param files: iterable of
+            :class:`~eulcm.xmlmap.boda.FileMasterTech_Base` or
+            :class:`~eulcm.xmlmap.boda.FileRecord`
+        :param version: optional datastream version the files were
+            read from; see :func:`eulcm.fetch.datastream_version`
+        '''
+        with self.db:
+            self.db.execute('DELETE FROM files WHERE pid = ?', (pid,))
+            self.db.executemany('INSERT INTO files (md5, pid, path, computer) VALUES (?, ?, ?, ?)',
+                ((f.md5, pid, f.path, f.computer) for f in files if f.md5))
+            self._set_version(pid, version)
+
+    def add_object(self, obj):
+        '''Index the :attr:`~eulcm.models.boda.Arrangement.filetech`
+        datastream for an :class:`~eulcm.models.boda.Arrangement`
+        object, unless it has already been indexed at the current
+        datastream version.  Returns True if the object was indexed.'''
+        version = datastream_version(obj.filetech)
+        if not self.needs_update(obj.pid, version):
+            return False
+        self.add(obj.pid, obj.filetech_files(records=True), version)
+        return True
+
+    def remove(self, pid):
+        'Remove all files for an object from the index.'
+        with self.db:
+            self.db.execute('DELETE FROM files WHERE pid = ?', (pid,))
+            self.db.execute('DELETE FROM sources WHERE pid = ?', (pid,))
+
+    def find(self, md5):
+        'List of :class:`FileLocation` for files with the specified checksum.'
+        return [FileLocation(*row) for row in
+                self.db.execute('SELECT pid, path, computer FROM files WHERE md5 = ?',
+                                (md5,))]
+
+    def find_many(self, checksums):
+        '''Find locations for a list of checksums.  Returns a
+        dictionary of md5 -> list of :class:`FileLocation`, for
+        checksums that were found.'''
+        checksums = list(set(checksums))
+        results = {}
+        # stay under the sqlite limit on query parameters
+        for i in range(0, len(checksums), 500):
+            batch = checksums[i:i + 500]
+            query = 'SELECT md5, pid, path, computer FROM files WHERE md5 IN (%s)' \
+                    % ','.join('?' * len(batch))
+            for row in self.db.execute(query, batch):
+                results.setdefault(row[0], []).append(FileLocation(*row[1:]))
+        return results
+
+    def duplicates(self):
+        '''Generator returning a tuple of (md5, list of
+        :class:`FileLocation`) for every checksum that occurs more
+        than once in the index.'''
+        rows = self.db.execute('''SELECT md5, pid, path, computer FROM files
+            WHERE md5 IN (SELECT md5 FROM files GROUP BY md5 HAVING count(*) > 1)
+            ORDER BY md5''')
+        current, locations = None, []
+        for row in rows:
+            if row[0] != current:
+                if locations:
+                    yield current, locations
+                current, locations = row[0], []
+            locations.append(FileLocation(*row[1:]))
+        if locations:
+            yield current, locations
+
+
+class ExpirationIndex(_SqliteIndex):
+    '''Date-ordered index of access restriction expiration dates from
+    :class:`~eulcm.xmlmap.boda.Rights` metadata, for finding objects
+    whose restrictions have expired without rereading every Rights
+    datastream.
+
+    :param filename: sqlite database file; defaults to an in-memory
+        database
+    '''
+
+    SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS sources (
+        pid TEXT PRIMARY KEY,
+        version TEXT
+    );
+    CREATE TABLE IF NOT EXISTS expirations (
+        pid TEXT PRIMARY KEY,
+        expiration TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS expirations_date ON expirations (expiration);
+    '''
+
+    def add(self, pid, rights, version=None):
+        '''Add, update, or remove the expiration date for a single
+        object, based on its rights metadata.
+
+        :param pid: object pid
+        :param rights: :class:`~eulcm.xmlmap.boda.Rights`
+        :param version: optional datastream version the rights were
+            read from; see :func:`eulcm.fetch.datastream_version`
+        '''
+        expiration = parse_w3cdtf(rights.access_restriction_expiration, end=True)
+        with self.db:
+            if expiration is None:
+                self.db.execute('DELETE FROM expirations WHERE pid = ?', (pid,))
+            else:
+                self.db.execute('INSERT OR REPLACE INTO expirations (pid, expiration) VALUES (?, ?)',
+                                (pid, expiration.isoformat()))
+            self._set_version(pid, version)
+
+    def add_object(self, obj):
+        '''Index the :attr:`~eulcm.models.boda.Arrangement.rights`
+        datastream for an :class:`~eulcm.models.boda.Arrangement`
+        object, unless it has already been indexed at the current
+        datastream version.  Returns True if the object was indexed.'''
+        version = datastream_version(obj.rights)
+        if not self.needs_update(obj.pid, version):
+            return False
+        self.add(obj.pid, obj.rights.content, version)
+        return True
+
+    def remove(self, pid):
+        'Remove an object from the index.'
+        with self.db:
+            self.db.execute('DELETE FROM expirations WHERE pid = ?', (pid,))
+            self.db.execute('DELETE FROM sources WHERE pid = ?', (pid,))
+
+    def upcoming(self, until=None, limit=None):
+        '''List of (pid, :class:`datetime.date`) tuples for indexed
+        expirations, in date order.  Restrictions expire after their
+        expiration date; see
+        :meth:`~eulcm.xmlmap.boda.Rights.access_decision`.
+
+        :param until: optional date; only return restrictions that will
+            have expired by this date (expiration dates before it)
+        :param limit: optional maximum number of results
+        '''
+        query = 'SELECT pid, expiration FROM expirations'
+        args = []
+        if until is not None:
+            query += ' WHERE expiration < ?'
+            args.append(until.isoformat())
+        query += ' ORDER BY expiration, pid'
+        if limit is not None:
+            query += ' LIMIT %d' % limit
+        return [(pid, parse_w3cdtf(date))
+                for pid, date in self.db.execute(query, args)]
+
+    def pop_expired(self, since=None, today=None):
+        '''Remove and return all objects whose access restriction has
+        expired, as a list of (pid, :class:`datetime.date`) tuples in
+        date order.  Popped objects are not returned again unless their
+        rights metadata changes and is reindexed.
+
+        :param since: optional date; only include restrictions that
+            expired after this date (e.g., the ``today`` of a previous
+            call)
+        :param today: date to check expiration against; defaults to the
+            current date.  Restrictions expire after their expiration
+            date, so only expiration dates before today are included.
+        '''
+        if today is None:
+            today = datetime.date.today()
+        query = 'SELECT pid, expiration FROM expirations WHERE expiration < ?'
+        args = [today.isoformat()]
+        if since is not None:
+            # a restriction expires the day after its expiration date
+            query += ' AND expiration >= ?'
+            args.append(since.isoformat())
+        query += ' ORDER BY expiration, pid'
+        with self.db:
+            expired = list(self.db.execute(query, args))
+            self.db.executemany('DELETE FROM expirations WHERE pid = ?',
+                                [(pid,) for pid, date in expired])
+        return [(pid, parse_w3cdtf(date)) for pid, date in expired]
+
+
+def normalize_ark(ark):
+    '''Short form of an ARK (``ark:/NAAN/name``), from either a short
+    ARK or a full, resolvable ARK URI.  Returns None if the value does
+    not contain an ARK.'''
+    if not ark:
+        return None
+    start = ark.find('ark:/')
+    if start == -1:
+        return None
+    return ark[start:].strip()
+
+
+class ArkIndex(_SqliteIndex):
+    '''Index of ARK identifiers to Fedora pids, from the MODS of
+    :class:`~eulcm.models.collection.v1_1.Collection` and
+    :class:`~eulcm.models.boda.Arrangement` objects, for resolving ARKs
+    without a repository search.
+
+    Lookups are answered from an in-memory dictionary that is loaded
+    from the database when the index is opened and kept current as
+    objects are added or removed through this index.  An index may be
+    shared between threads (e.g., the request threads of an ARK
+    resolver).
+
+    :param filename: sqlite database file; defaults to an in-memory
+        database
+    '''
+
+    SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS sources (
+        pid TEXT PRIMARY KEY,
+        version TEXT
+    );
+    CREATE TABLE IF NOT EXISTS arks (
+        ark TEXT PRIMARY KEY,
+        pid TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS arks_pid ON arks (pid);
+    '''
+
+    def __init__(self, filename=':memory:'):
+        # database access is serialized with a lock, so the connection
+        # can be used from any thread
+        super(ArkIndex, self).__init__(filename, check_same_thread=False)
+        self._lock = threading.RLock()
+        # in-memory ark -> pid dictionary
+        self._arks = {}
+        self.reload()
+
+    def indexed_version(self, pid):
+        with self._lock:
+            return super(ArkIndex, self).indexed_version(pid)
+
+    def add(self, pid, mods, version=None):
+        '''Add or replace the ARKs for a single object.  Both ``ark``
+        and ``uri`` identifiers containing an ARK are indexed, in short
+        form; see :func:`normalize_ark`.
+
+        :param pid: object pid
+        :param mods: MODS xml object (e.g.,
+            :class:`~eulcm.xmlmap.mods.MODS` or
+            :class:`~eulcm.xmlmap.boda.ArrangementMods`)
+        :param version: optional datastream version the MODS was
+            read from; see :func:`eulcm.fetch.datastream_version`
+        '''
+        ids = MODS.bulk_typed_identifiers([mods])[0]
+        arks = set(normalize_ark(value)
+                   for value in ids.get('ark', []) + ids.get('uri', []))
+        arks.discard(None)
+        with self._lock:
+            with self.db:
+                old_arks = [row[0] for row in
+                            self.db.execute('SELECT ark FROM arks WHERE pid = ?', (pid,))]
+                self.db.execute('DELETE FROM arks WHERE pid = ?', (pid,))
+                self.db.executemany('INSERT OR REPLACE INTO arks (ark, pid) VALUES (?, ?)',
+                                    [(ark, pid) for ark in arks])
+                self._set_version(pid, version)
+            for ark in old_arks:
+                self._arks.pop(ark, None)
+            self._arks.update((ark, pid) for ark in arks)
+
+    def add_object(self, obj):
+        '''Index the ``mods`` datastream for an object, unless it has
+        already been indexed at the current datastream version.
+        Returns True if the object was indexed.'''
+        version = datastream_version(obj.mods)
+        if not self.needs_update(obj.pid, version):
+            return False
+        self.add(obj.pid, obj.mods.content, version)
+        return True
+
+    def remove(self, pid):
+        'Remove all ARKs for an object from the index.'
+        with self._lock:
+            with self.db:
+                old_arks = [row[0] for row in
+                            self.db.execute('SELECT ark FROM arks WHERE pid = ?', (pid,))]
+                self.db.execute('DELETE FROM arks WHERE pid = ?', (pid,))
+                self.db.execute('DELETE FROM sources WHERE pid = ?', (pid,))
+            for ark in old_arks:
+                self._arks.pop(ark, None)
+
+    def reload(self):
+        '''Reload the in-memory lookup from the database, e.g. if the
+        database file has been updated by another process.'''
+        with self._lock:
+            self._arks = dict(self.db.execute('SELECT ark, pid FROM arks'))
+
+    def close(self):
+        'Close the database connection.'
+        with self._lock:
+            super(ArkIndex, self).close()
+
+    def lookup(self, ark):
+        '''Pid for an ARK or ARK URI, or None if the ARK is not indexed.'''
+        return self._arks.get(normalize_ark(ark))
+
+
+class SeriesIndex(_SqliteIndex):
+    '''Index of series and subseries membership for
+    :class:`~eulcm.models.boda.Arrangement` objects, based on the
+    canonical series information from
+    :meth:`~eulcm.xmlmap.boda.ArrangementMods.series_info`, for
+    finding all items in a series without loading every MODS
+    datastream.  Series and subseries are identified by their full
+    :class:`~eulcm.xmlmap.boda.SeriesKey`; use :meth:`find` to look up
+    keys by :attr:`~eulcm.xmlmap.boda.Series_Base.full_id` or
+    :attr:`~eulcm.xmlmap.boda.Series_Base.short_id`.
+
+    :param filename: sqlite database file; defaults to an in-memory
+        database
+    '''
+
+    SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS sources (
+        pid TEXT PRIMARY KEY,
+        version TEXT
+    );
+    CREATE TABLE IF NOT EXISTS series_members (
+        pid TEXT PRIMARY KEY,
+        series TEXT NOT NULL,
+        subseries TEXT,
+        series_full_id TEXT,
+        series_short_id TEXT,
+        subseries_full_id TEXT,
+        subseries_short_id TEXT
+    );
+    CREATE INDEX IF NOT EXISTS series_members_series
+        ON series_members (series, subseries);
+    CREATE INDEX IF NOT EXISTS series_members_series_full_id
+        ON series_members (series_full_id);
+    CREATE INDEX IF NOT EXISTS series_members_series_short_id
+        ON series_members (series_short_id);
+    CREATE INDEX IF NOT EXISTS series_members_subseries_full_id
+        ON series_members (subseries_full_id);
+    CREATE INDEX IF NOT EXISTS series_members_subseries_short_id
+        ON series_members (subseries_short_id);
+    '''
+
+    # series keys are stored as json lists of the SeriesKey fields,
+    # for exact membership queries; full and short ids are also stored
+    # in separate indexed columns for find
+
+    @staticmethod
+    def _encode(key):
+        return json.dumps(list(key)) if key is not None else None
+
+    @staticmethod
+    def _decode(value):
+        return SeriesKey(*json.loads(value)) if value is not None else None
+
+    def add(self, pid, mods, version=None):
+        '''Add or replace series information for a single object.
+
+        :param pid: object pid
+        :param mods: :class:`~eulcm.xmlmap.boda.ArrangementMods`
+        :param version: optional datastream version the MODS was
+            read from; see :func:`eulcm.fetch.datastream_version`
+        '''
+        with self.db:
+            self._add(pid, mods, version)
+
+    def _add(self, pid, mods, version):
+        series, subseries = mods.series_info()
+        self.db.execute('DELETE FROM series_members WHERE pid = ?', (pid,))
+        if series is not None:
+            self.db.execute('''INSERT INTO series_members (pid, series, subseries,
+                series_full_id, series_short_id, subseries_full_id, subseries_short_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                (pid, self._encode(series), self._encode(subseries),
+                 series.full_id, series.short_id,
+                 subseries.full_id if subseries is not None else None,
+                 subseries.short_id if subseries is not None else None))
+        self._set_version(pid, version)
+
+    def add_object(self, obj):
+        '''Index the :attr:`~eulcm.models.boda.Arrangement.mods`
+        datastream for an :class:`~eulcm.models.boda.Arrangement`
+        object, unless it has already been indexed at the current
+        datastream version.  Returns True if the object was indexed.'''
+        version = datastream_version(obj.mods)
+        if not self.needs_update(obj.pid, version):
+            return False
+        self.add(obj.pid, obj.mods.content, version)
+        return True
+
+    def build(self, api, pids, workers=DEFAULT_WORKERS):
+        '''Index a list of objects in bulk: MODS datastream profiles
+        are retrieved concurrently to find objects that have not been
+        indexed at their current version, then MODS content for those
+        objects is retrieved concurrently and stored in a single
+        transaction.  Returns the number of objects indexed.
+
+        :param api: :class:`eulfedora.api.REST_API` instance
+        :param pids: list of :class:`~eulcm.models.boda.Arrangement` pids
+        :param workers: maximum number of concurrent requests
+        '''
+        dsid = Arrangement.mods.id
+        profiles = fetch_profiles(api, pids, dsid, workers)
+        versions = dict((pid, datastream_version(profile) if profile is not None else None)
+                        for pid, profile in profiles.items())
+        changed = [pid for pid in pids if self.needs_update(pid, versions[pid])]
+        # objects without MODS do not need their content retrieved
+        content = fetch_datastreams(api, [pid for pid in changed
+                                          if versions[pid] is not None], [dsid], workers)
+        with self.db:
+            for pid in changed:
+                data = content.get((pid, dsid))
+                mods = ArrangementMods()
+                if data is not None:
+                    mods = load_xmlobject_from_string(data, ArrangementMods)
+                self._add(pid, mods, versions[pid])
+        return len(changed)
+
+    def remove(self, pid):
+        'Remove an object from the index.'
+        with self.db:
+            self.db.execute('DELETE FROM series_members WHERE pid = ?', (pid,))
+            self.db.execute('DELETE FROM sources WHERE pid = ?', (pid,))
+
+    def find(self, series_id):
+        '''Find series or subseries by id.  Returns a sorted list of
+        distinct (series, subseries) :class:`~eulcm.xmlmap.boda.SeriesKey`
+        tuples for series with a matching full id or short id (with
+        subseries None), and for subseries with a matching id.
+
+        :param series_id: series or subseries full id or short id
+        '''
+        found = set()
+        for (series,) in self.db.execute('''SELECT DISTINCT series FROM series_members
+                WHERE series_full_id = ? OR series_short_id = ?''', (series_id, series_id)):
+            found.add((self._decode(series), None))
+        for series, subseries in self.db.execute('''SELECT DISTINCT series, subseries
+                FROM series_members
+                WHERE subseries_full_id = ? OR subseries_short_id = ?''', (series_id, series_id)):
+            found.add((self._decode(series), self._decode(subseries)))
+        return sorted(found, key=lambda keys: (_key_order(keys[0]),
+                                               _key_order(keys[1])))
+
+    def members(self, series, subseries=None, include_subseries=True):
+        '''Sorted list of pids for objects in a series or subseries.
+
+        :param series: series :class:`~eulcm.xmlmap.boda.SeriesKey`
+        :param subseries: optional subseries
+            :class:`~eulcm.xmlmap.boda.SeriesKey`; if specified, only
+            objects in that subseries are returned
+        :param include_subseries: when no subseries is specified,
+            include objects in all subseries of the series; if False,
+            only objects directly in the series are returned
+        '''
+        query = 'SELECT pid FROM series_members WHERE series = ?'
+        args = [self._encode(series)]
+        if subseries is not None:
+            query += ' AND subseries = ?'
+            args.append(self._encode(subseries))
+        elif not include_subseries:
+            query += ' AND subseries IS NULL'
+        query += ' ORDER BY pid'
+        return [row[0] for row in self.db.execute(query, args)]
+
+    def series_info(self, pid):
+        '''Indexed (series, subseries) for an object, as
+        :class:`~eulcm.xmlmap.boda.SeriesKey`; see
+        :meth:`~eulcm.xmlmap.boda.ArrangementMods.series_info`.'''
+        row = self.db.execute('SELECT series, subseries FROM series_members WHERE pid = ?',
+                              (pid,)).fetchone()
+        if row is None:
+            return (None, None)
+        return (self._decode(row[0]), self._decode(row[1]))
+
+    def subseries(self, series):
+        '''List of distinct subseries, as
+        :class:`~eulcm.xmlmap.boda.SeriesKey`, for a series
+        :class:`~eulcm.xmlmap.boda.SeriesKey`.'''
+        rows = self.db.execute('''SELECT DISTINCT subseries FROM series_members
+            WHERE series = ? AND subseries IS NOT NULL''', (self._encode(series),))
+        return sorted((self._decode(row[0]) for row in rows), key=_key_order)
+
+
+def _key_order(key):
+    # sort order for series keys, which may be or contain None
+    return tuple('' if value is None else value for value in key or ())
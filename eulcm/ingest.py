@@ -0,0 +1,257 @@
+# file eulcm/ingest.py
+#
+#   Copyright 2012 Emory University Libraries
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+Bulk ingest of files from a disk image (or any local copy of a
+legacy computer's contents) as
+:class:`~eulcm.models.boda.RushdieFile` objects, driven by a
+FileMasterTech manifest describing the files.
+
+For each file in the manifest, the local file is uploaded to Fedora
+while its MD5 checksum is calculated, the checksum is compared with
+the manifest, and a new object is ingested with ``ORIGINAL``,
+``FileMasterTech``, ``MODS`` and (optionally) ``Rights`` datastreams
+and an ``isMemberOfCollection`` relation.  Files are ingested
+concurrently, failed requests are retried, and completed files are
+recorded in an :class:`IngestCheckpoint` so that an interrupted
+ingest can be resumed.
+
+'''
+
+from collections import namedtuple
+from copy import deepcopy
+import hashlib
+import mimetypes
+import os
+import time
+
+from eulfedora.util import RequestFailed
+from requests.exceptions import ConnectionError, Timeout
+
+from eulcm.fetch import iter_concurrently
+from eulcm.models.boda import RushdieFile
+from eulcm.report import CsvReport
+from eulcm.xmlmap.boda import FileMasterTech
+
+
+DEFAULT_INGEST_WORKERS = 4
+'default number of concurrent ingests'
+
+# ingest statuses
+INGESTED = 'ingested'
+MISSING = 'missing'
+CHECKSUM_MISMATCH = 'checksum mismatch'
+ERROR = 'error'
+
+IngestResult = namedtuple('IngestResult', ['path', 'pid', 'md5', 'status', 'error'])
+'''Result of ingesting a single file: manifest path, new object pid,
+MD5 checksum calculated from the local file, status (one of
+:data:`INGESTED`, :data:`MISSING`, :data:`CHECKSUM_MISMATCH`, or
+:data:`ERROR`), and error message.'''
+
+
+class _HashingReader(object):
+    # file-like wrapper that calculates an md5 checksum of the content
+    # as it is read
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.md5 = hashlib.md5()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.md5.update(data)
+        return data
+
+    def __len__(self):
+        # used by the multipart encoder to calculate the request size
+        return os.fstat(self.fileobj.fileno()).st_size - self.fileobj.tell()
+
+
+def _retryable(err):
+    # server errors and connection problems may succeed when retried
+    if isinstance(err, RequestFailed):
+        return err.code is None or err.code >= 500
+    return isinstance(err, (ConnectionError, Timeout))
+
+
+def _exists(repo, pid):
+    # check whether an object exists in fedora
+    try:
+        repo.api.getObjectProfile(pid)
+    except RequestFailed as err:
+        if err.code == 404:
+            return False
+        raise
+    return True
+
+
+class IngestCheckpoint(CsvReport):
+    '''Ingest results stored in a CSV file, one row per file; see
+    :class:`~eulcm.report.CsvReport`.  Files that were ingested or are
+    missing locally are skipped when an ingest is resumed.
+
+    :param filename: checkpoint file; created if it does not exist
+    '''
+
+    RESULT = IngestResult
+
+    def __init__(self, filename):
+        self.completed = {}
+        'dictionary of manifest path -> pid for files already ingested'
+        self.skip = set()
+        'set of manifest paths that do not need to be ingested again'
+        super(IngestCheckpoint, self).__init__(filename)
+
+    def _update(self, result):
+        if result.status == INGESTED:
+            self.completed[result.path] = result.pid
+        if result.status in (INGESTED, MISSING):
+            self.skip.add(result.path)
+
+
+def ingest_file(repo, root, filetech, collection=None, rights=None,
+                prepare=None, retries=3, retry_delay=1, logMessage=None):
+    '''Ingest a single file from a manifest as a new
+    :class:`~eulcm.models.boda.RushdieFile`.  Errors are captured in
+    the result rather than raised.
+
+    :param repo: :class:`eulfedora.server.Repository`
+    :param root: local directory that manifest paths are relative to
+    :param filetech: :class:`~eulcm.xmlmap.boda.FileMasterTech_Base`
+        from the manifest
+    :param collection: optional collection object for the
+        ``isMemberOfCollection`` relation
+    :param rights: optional :class:`~eulcm.xmlmap.boda.Rights`, copied
+        to the new object
+    :param prepare: optional function called with the new object and
+        the file metadata before ingest, for additional metadata
+    :param retries: number of times to retry after server or
+        connection errors; if saving the object fails this way, it is
+        treated as ingested if it exists in Fedora, and only retried
+        otherwise
+    :param retry_delay: seconds to wait before the first retry; doubled
+        for each subsequent retry
+    :param logMessage: optional ingest log message
+    :returns: :class:`IngestResult`
+    '''
+    path = filetech.path
+    local_path = os.path.join(root, path.lstrip('/'))
+    if not os.path.isfile(local_path):
+        return IngestResult(path, None, None, MISSING, None)
+
+    obj = None
+    md5 = None
+    saving = False
+    attempt = 0
+    while True:
+        try:
+            if obj is None:
+                obj = repo.get_object(type=RushdieFile)
+                name = filetech.name()
+                obj.label = name
+                obj.mods.content.title = name
+                obj.filetech.content = FileMasterTech()
+                obj.filetech.content.node.append(deepcopy(filetech.node))
+                if rights is not None:
+                    obj.rights.content = type(rights)(deepcopy(rights.node))
+                if collection is not None:
+                    obj.collection = collection
+                obj.original.mimetype = mimetypes.guess_type(name)[0] or \
+                                        'application/octet-stream'
+                if prepare is not None:
+                    prepare(obj, filetech)
+
+            # upload content, calculating the checksum as it is sent
+            with open(local_path, 'rb') as content:
+                reader = _HashingReader(content)
+                upload_id = repo.api.upload(reader, content_type=obj.original.mimetype)
+            md5 = reader.md5.hexdigest()
+            expected = (filetech.md5 or '').strip().lower()
+            if expected and md5 != expected:
+                return IngestResult(path, None, md5, CHECKSUM_MISMATCH,
+                                    'manifest md5 is %s' % expected)
+
+            obj.original.ds_location = upload_id
+            # fedora verifies the checksum on ingest
+            obj.original.checksum = md5
+            obj.original.checksum_type = 'MD5'
+            saving = True
+            obj.save(logMessage)
+            return IngestResult(path, obj.pid, md5, INGESTED, None)
+
+        except Exception as err:
+            error = '%s: %s' % (err.__class__.__name__, err)
+            if saving and _retryable(err):
+                # the ingest may have completed even though the response
+                # was lost; retrying would then fail or create a
+                # duplicate, so retry only if the object does not exist
+                saving = False
+                try:
+                    exists = _exists(repo, obj.pid)
+                except Exception:
+                    return IngestResult(path, obj.pid, md5, ERROR,
+                                        '%s (ingest status unknown)' % error)
+                if exists:
+                    return IngestResult(path, obj.pid, md5, INGESTED, None)
+            if attempt < retries and _retryable(err):
+                time.sleep(retry_delay * 2 ** attempt)
+                attempt += 1
+                continue
+            return IngestResult(path, None, md5, ERROR, error)
+
+
+def ingest_files(repo, root, manifest, collection=None, rights=None,
+                 checkpoint=None, workers=DEFAULT_INGEST_WORKERS,
+                 retries=3, retry_delay=1, prepare=None, logMessage=None,
+                 progress=None):
+    '''Ingest all files in a FileMasterTech manifest as new
+    :class:`~eulcm.models.boda.RushdieFile` objects, using a bounded
+    pool of worker threads; see :func:`ingest_file`.  The manifest is
+    parsed incrementally.  Generator returning :class:`IngestResult`
+    as files complete.
+
+    :param repo: :class:`eulfedora.server.Repository`
+    :param root: local directory that manifest paths are relative to
+    :param manifest: FileMasterTech xml filename or file-like object
+    :param collection: optional collection object for the
+        ``isMemberOfCollection`` relation
+    :param rights: optional :class:`~eulcm.xmlmap.boda.Rights` for
+        all new objects
+    :param checkpoint: optional :class:`IngestCheckpoint`; files already
+        completed are skipped, and new results are recorded
+    :param workers: maximum number of concurrent ingests
+    :param retries: number of retries for server or connection errors
+    :param retry_delay: seconds to wait before the first retry
+    :param prepare: optional function called with each new object and
+        its file metadata before ingest
+    :param logMessage: optional ingest log message
+    :param progress: optional callback, called with each result
+    '''
+    files = FileMasterTech.iterfiles(manifest)
+    if checkpoint is not None:
+        files = (f for f in files if f.path not in checkpoint.skip)
+
+    def ingest(filetech):
+        return ingest_file(repo, root, filetech, collection, rights,
+                           prepare, retries, retry_delay, logMessage)
+
+    for result in iter_concurrently(ingest, files, workers):
+        if checkpoint is not None:
+            checkpoint.record(result)
+        if progress is not None:
+            progress(result)
+        yield result
@@ -33,5 +33,82 @@ defined within the appropriate version (matching the Fedora content
 model version), so that the versions can be distinguished and the
 appropriate version can be imported.
 
+**Lazy loading**
+
+Importing :mod:`eulcm.models` does not import any of the model
+modules (or :mod:`eulfedora.models`).  Model classes can be loaded on
+first use by content model URI with :func:`get_model`, or as
+attributes of this module, e.g.::
+
+  from eulcm import models
+  models.Arrangement      # imports eulcm.models.boda
+
+Unversioned ``Collection`` refers to the most recent version
+(:class:`eulcm.models.collection.v1_1.Collection`).  The
+``CONTENT_MODELS`` attribute, a dictionary of content model URI ->
+class, is built from the classes when first accessed.
 
 '''
+
+from importlib import import_module
+
+
+MODEL_CLASSES = (
+    'eulcm.models.collection.v1_0.Collection',
+    'eulcm.models.collection.v1_1.Collection',
+    'eulcm.models.boda.Arrangement',
+    'eulcm.models.boda.Mailbox',
+    'eulcm.models.boda.EmailMessage',
+    'eulcm.models.boda.RushdieFile',
+)
+'''Dotted paths of all eulcm :class:`~eulfedora.models.DigitalObject`
+classes with content models; see :func:`model_classes`.'''
+
+# unversioned names refer to the last (most recent) version listed
+_LAZY_ATTRIBUTES = dict((path.rsplit('.', 1)[1], path.rsplit('.', 1)[0])
+                        for path in MODEL_CLASSES)
+
+
+def _load(path):
+    module, name = path.rsplit('.', 1)
+    return getattr(import_module(module), name)
+
+
+def model_classes():
+    '''List of all eulcm content model classes (see
+    :data:`MODEL_CLASSES`), importing their modules.'''
+    return [_load(path) for path in MODEL_CLASSES]
+
+
+def _content_models():
+    # dictionary of content model URI -> class, based on the first
+    # (most specific) content model of each class
+    return dict((cls.CONTENT_MODELS[0], cls) for cls in model_classes())
+
+
+def get_model(content_model):
+    '''Get the eulcm :class:`~eulfedora.models.DigitalObject` class for
+    a content model URI (the first of the class's ``CONTENT_MODELS``),
+    importing the model modules on first use.  Returns None for content
+    models not defined in eulcm.'''
+    content_models = globals().get('CONTENT_MODELS')
+    if content_models is None:
+        content_models = __getattr__('CONTENT_MODELS')
+    return content_models.get(str(content_model))
+
+
+def __getattr__(name):
+    # load model classes on first access (Python 3.7+)
+    if name == 'CONTENT_MODELS':
+        # dictionary of content model URI -> eulcm class; see get_model
+        value = _content_models()
+    elif name in _LAZY_ATTRIBUTES:
+        value = getattr(import_module(_LAZY_ATTRIBUTES[name]), name)
+    else:
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES) | set(['CONTENT_MODELS']))
@@ -23,18 +23,27 @@ more standard cmodels soon.
 
 '''
 
+from collections import namedtuple
 import email
+from email.parser import HeaderParser, BytesHeaderParser
+import hashlib
+import multiprocessing
+import os
 
 from eulfedora import models as fedora_models
 from eulfedora.util import RequestFailed
 from eulfedora.rdfns import relsext
-from eulxml.xmlmap import mods, cerp
+from eulxml.xmlmap import load_xmlobject_from_string, mods, cerp
 
+from eulcm.cache import IdentityMapped
+from eulcm.fetch import DEFAULT_WORKERS, FEDORA_LABEL, fetch_datastreams, \
+     prefetch_objects, uri_to_pid
+from eulcm.fixity import CHUNK_SIZE, check_fixity
 from eulcm.models.collection.v1_1 import Collection
 from eulcm.xmlmap.boda import Rights, ArrangementMods, FileMasterTech
 
 
-class Arrangement(fedora_models.DigitalObject):
+class Arrangement(IdentityMapped, fedora_models.DigitalObject):
     '''Subclass of :class:`eulfedora.models.DigitalObject` for
     "arrangement" content, i.e., born-digital materials which need to
     be processed and arranged into series before they can be made
@@ -73,12 +82,59 @@ class Arrangement(fedora_models.DigitalObject):
     object is a member of, via `isMemberOfCollection` relation.
     '''
 
+    @classmethod
+    def prefetch(cls, repo, pids, datastreams=('rights', 'mods'),
+                 workers=DEFAULT_WORKERS):
+        '''Initialize a list of objects with the content of the named
+        datastreams already loaded, retrieved with concurrent requests
+        (e.g., for search results that display rights and MODS for
+        every item); see :func:`eulcm.fetch.prefetch_objects`.
+
+        :param repo: :class:`eulfedora.server.Repository`
+        :param pids: list of pids
+        :param datastreams: datastream attribute names to load; any of
+            ``rights``, ``mods``, ``filetech``, or other datastreams
+            defined on the class
+        :param workers: maximum number of concurrent requests
+        :returns: list of objects, in the same order as the pids
+        '''
+        return prefetch_objects(repo, pids, cls, datastreams, workers)
+
+    def filetech_files(self, records=False):
+        '''Generator returning
+        :class:`~eulcm.xmlmap.boda.FileMasterTech_Base` instances for
+        the files described in :attr:`filetech`, streamed and parsed
+        incrementally from Fedora rather than loading the entire
+        datastream into memory.  Uses locally cached or modified
+        :attr:`filetech` content when it is available.
+
+        :param records: if True, return
+            :class:`~eulcm.xmlmap.boda.FileRecord` tuples instead
+        '''
+        if self.filetech._content is not None or not self.filetech.exists:
+            if records:
+                files = self.filetech.content.file_records()
+            else:
+                files = self.filetech.content.file
+            for f in files:
+                yield f
+            return
+
+        r = self.api.getDatastreamDissemination(self.pid, self.filetech.id,
+                                                stream=True)
+        try:
+            r.raw.decode_content = True
+            for f in FileMasterTech.iterfiles(r.raw, records=records):
+                yield f
+        finally:
+            r.close()
+
 
 
 ### email folder and message objects
 
 
-class Mailbox(fedora_models.DigitalObject):
+class Mailbox(IdentityMapped, fedora_models.DigitalObject):
     ''':class:`rushdieweb.fedorabase.models.DocumentObject` subclass
     to represent an email mailbox.
 
@@ -97,19 +153,287 @@ class Mailbox(fedora_models.DigitalObject):
 
     # auto-generated reverse relations: messages, constituent_files
 
+    def message_summaries(self, workers=DEFAULT_WORKERS):
+        '''Summary information for all :attr:`messages` in this
+        mailbox, as a list of :class:`MessageSummary`.  Finds messages
+        and their labels with a single Resource Index query, and
+        retrieves CERP and Rights content for all messages with
+        concurrent requests, without initializing individual
+        :class:`EmailMessage` objects.
+
+        :param workers: maximum number of concurrent datastream requests
+        '''
+        query = '''SELECT ?pid ?label WHERE {
+            ?pid <%(rel)s> <%(uri)s> .
+            OPTIONAL { ?pid <%(label)s> ?label }
+        }''' % {'rel': relsext.isPartOf, 'uri': self.uriref,
+                'label': FEDORA_LABEL}
+        results = [(uri_to_pid(r['pid']), r.get('label') or None)
+                   for r in self.risearch.sparql_query(query)]
+
+        content = fetch_datastreams(self.api, [pid for pid, label in results],
+            [EmailMessage.cerp.id, Arrangement.rights.id], workers)
+
+        summaries = []
+        for pid, label in results:
+            subject = date = sender = access_code = None
+            data = content.get((pid, EmailMessage.cerp.id))
+            if data:
+                msg = load_xmlobject_from_string(data, cerp.Message)
+                subject = _first(msg.subject_list)
+                date = _first(msg.orig_date_list)
+                sender = _first(msg.from_list)
+            data = content.get((pid, Arrangement.rights.id))
+            if data:
+                rights = load_xmlobject_from_string(data, Rights)
+                if rights.access_status is not None:
+                    access_code = rights.access_status.code
+            summaries.append(MessageSummary(pid, label, subject, date,
+                                            sender, access_code))
+        return summaries
+
+    def update_cerp(self, messages=None, processes=None, save=False,
+                    logMessage=None, progress=None, dirty_only=False,
+                    batch_size=None):
+        '''Regenerate CERP xml for all :attr:`messages` in this mailbox
+        (see :meth:`EmailMessage.update_cerp`), using a pool of worker
+        processes for the conversion.  Message data is retrieved in
+        batches and updated CERP is set (and optionally saved) in the
+        current thread; the next batch of message data is retrieved
+        while the previous batch is being converted.
+
+        Errors are captured per message rather than stopping the
+        batch.  Returns a dictionary of pid -> error message for any
+        messages that could not be retrieved, converted or saved.
+
+        :param messages: optional list of :class:`EmailMessage`
+            objects to update; defaults to :attr:`messages`
+        :param processes: number of worker processes; defaults to the
+            number of CPUs
+        :param save: if True, save each message after updating CERP
+        :param logMessage: optional log message for saves
+        :param progress: optional callable, called with the number of
+            messages processed and the total after each message
+        :param dirty_only: if True, only update messages where CERP is
+            not current (see :meth:`EmailMessage.cerp_is_current`)
+        :param batch_size: number of messages retrieved at a time;
+            defaults to four per worker process
+        '''
+        if messages is None:
+            messages = self.messages
+        if dirty_only:
+            messages = [msg for msg in messages if not msg.cerp_is_current()]
+        by_pid = dict((msg.pid, msg) for msg in messages)
+        messages = list(by_pid.values())
+        if processes is None:
+            processes = os.cpu_count() or 1
+        if batch_size is None:
+            batch_size = 4 * processes
+        total = len(messages)
+        errors = {}
+        done = [0]
+
+        def finish(pid, error):
+            if error is not None:
+                errors[pid] = error
+            done[0] += 1
+            if progress is not None:
+                progress(done[0], total)
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            pending = None
+            for start in range(0, total + batch_size, batch_size):
+                running = None
+                batch = messages[start:start + batch_size]
+                if batch:
+                    data = []
+                    for msg in batch:
+                        try:
+                            data.append((msg.pid, msg.mime_data.content.as_bytes()))
+                        except Exception as err:
+                            finish(msg.pid, _error_message(err))
+                    running = pool.map_async(_generate_cerp, data)
+
+                # update messages from the previous batch while the
+                # current batch is converted
+                if pending is not None:
+                    for pid, xml, error in pending.get():
+                        msg = by_pid[pid]
+                        if error is None:
+                            try:
+                                msg.cerp.content = load_xmlobject_from_string(xml, cerp.Message)
+                                msg._set_cerp_hash()
+                                if save:
+                                    msg.save(logMessage)
+                            except Exception as err:
+                                error = _error_message(err)
+                        finish(pid, error)
+                pending = running
+        finally:
+            pool.close()
+            pool.join()
+
+        return errors
+
+
+MessageSummary = namedtuple('MessageSummary', ['pid', 'label', 'subject',
+                                               'date', 'sender', 'access_code'])
+'''Summary information for a single :class:`EmailMessage`, as returned
+by :meth:`Mailbox.message_summaries`: pid, object label, subject, date,
+and sender (from CERP), and access status code (from Rights).'''
+
+def _first(values):
+    # first item in a list field, or None
+    return values[0] if len(values) else None
+
+def _error_message(err):
+    return '%s: %s' % (err.__class__.__name__, err)
+
+def _generate_cerp(args):
+    # worker function for Mailbox.update_cerp: convert raw message data
+    # to serialized CERP xml; returns a tuple of pid, xml, error message
+    pid, data = args
+    try:
+        msg = LazyEmailMessage.from_bytes(data)
+        return pid, cerp.Message.from_email_message(msg).serialize(), None
+    except Exception as err:
+        return pid, None, _error_message(err)
+
+
+class LazyEmailMessage(email.message.Message):
+    ''':class:`email.message.Message` subclass that parses message
+    headers immediately but only parses the message body (including
+    any MIME parts and attachments) when it is first accessed, so
+    that header information such as subject and date can be read
+    without processing the full message.  Serializing an unparsed
+    message returns the original body as-is.
+
+    Use :meth:`from_bytes`, :meth:`from_binary_file`, or
+    :meth:`from_string` to initialize.
+    '''
+
+    _unparsed = False
+    _serializing = False
+    _binary = False
+
+    @classmethod
+    def from_string(cls, data):
+        'Initialize a new :class:`LazyEmailMessage` from message text.'
+        msg = HeaderParser(_class=cls).parsestr(data)
+        msg._unparsed = True
+        return msg
+
+    @classmethod
+    def from_bytes(cls, data):
+        '''Initialize a new :class:`LazyEmailMessage` from raw message
+        bytes, without decoding the full message to a string first.'''
+        msg = BytesHeaderParser(_class=cls).parsebytes(data)
+        msg._unparsed = msg._binary = True
+        return msg
+
+    @classmethod
+    def from_binary_file(cls, fp):
+        '''Initialize a new :class:`LazyEmailMessage` by reading from a
+        binary file-like object, e.g. an open file or a streaming http
+        response, without first reading the entire message into memory
+        as a single string.'''
+        msg = BytesHeaderParser(_class=cls).parse(fp)
+        msg._unparsed = msg._binary = True
+        return msg
+
+    @property
+    def is_parsed(self):
+        'boolean indicating if the message body has been parsed'
+        return not self._unparsed
+
+    def _get_payload(self):
+        if self._unparsed and not self._serializing:
+            # message body is stored as a string until parsed; only
+            # multipart and message content need to be parsed further
+            if self.get_content_maintype() in ('multipart', 'message'):
+                if self._binary:
+                    full = email.message_from_bytes(self.as_bytes())
+                else:
+                    full = email.message_from_string(self.as_string())
+                self._body = full._payload
+                self.preamble = full.preamble
+                self.epilogue = full.epilogue
+            self._unparsed = False
+        return self._body
+
+    def _set_payload(self, value):
+        # a payload set explicitly replaces the unparsed body
+        self._body = value
+        self._unparsed = False
+
+    # payload is accessed directly by email.message and email.generator
+    _payload = property(_get_payload, _set_payload)
+
+    def as_string(self, *args, **kwargs):
+        # serialize without parsing the body, if it hasn't been parsed
+        self._serializing = True
+        try:
+            return email.message.Message.as_string(self, *args, **kwargs)
+        finally:
+            self._serializing = False
+
+    def as_bytes(self, unixfrom=False, policy=None):
+        if self._unparsed and self._binary:
+            # serialize headers and the original body bytes, without
+            # parsing; the generator would replace any 8-bit content
+            # in an unparsed body
+            policy = policy or self.policy
+            data = [policy.fold_binary(name, value) for name, value in self._headers]
+            if unixfrom and self.get_unixfrom():
+                data.insert(0, (self.get_unixfrom() + policy.linesep).encode('ascii'))
+            data.append(policy.linesep.encode('ascii'))
+            data.append(self._body.encode('ascii', 'surrogateescape'))
+            return b''.join(data)
+        return email.message.Message.as_bytes(self, unixfrom, policy)
+
 
 class EmailMessageDatastreamObject(fedora_models.DatastreamObject):
     ''':class:`eulfedora.models.DatastreamObject` subclass for
-    handling email message datastreams.
+    handling email message datastreams.  Content is loaded as a
+    :class:`LazyEmailMessage`, parsed directly from the streamed
+    response bytes; message headers are available immediately and
+    the body is parsed on first access.
     '''
     default_mimetype = 'message/rfc822'
     'default mimetype for message datastreams'
-    
+
+    def _get_content(self):
+        # parse existing content from the response stream instead of
+        # loading the full response body into memory first
+        if self._content is None and self.exists:
+            r = self.obj.api.getDatastreamDissemination(self.obj.pid, self.id,
+                stream=True, asOfDateTime=self.as_of_date)
+            try:
+                r.raw.decode_content = True
+                self._content = LazyEmailMessage.from_binary_file(r.raw)
+            finally:
+                r.close()
+            self.digest = self._content_digest()
+        return super(EmailMessageDatastreamObject, self)._get_content()
+
+    content = property(_get_content, fedora_models.DatastreamObject._set_content,
+                       None, fedora_models.DatastreamObject.content.__doc__)
+
     def _convert_content(self, data, url):
-        return email.message_from_string(data)
+        if isinstance(data, bytes):
+            return LazyEmailMessage.from_bytes(data)
+        return LazyEmailMessage.from_string(data)
+
+    def _raw_content(self):
+        # messages parsed from bytes should be serialized as bytes, to
+        # preserve any 8-bit content as-is
+        if getattr(self.content, '_binary', False):
+            return self.content.as_bytes()
+        return super(EmailMessageDatastreamObject, self)._raw_content()
 
     def _bootstrap_content(self):
-        return email.Message()
+        return email.message.Message()
 
 
 class EmailMessageDatastream(fedora_models.Datastream):
@@ -143,13 +467,62 @@ class EmailMessage(Arrangement):
     # NOTE: first batch of messages created (Performa 5400) have rels-ext
     # relations in both directions, but we are not preserving that.
 
-    def update_cerp(self):
+    def update_cerp(self, dirty_only=False):
         '''
         Generate CERP xml for :attr:`EmailMessage.cerp.content` based
         on :attr:`EmailMessage.mime_data.content`.  Convenience
         wrapper around :meth:`eulxml.xmlmap.cerp.Message.from_email_message`.
+
+        The checksum of the MIME data is stored in the CERP message
+        hash, so that unchanged messages can be skipped.
+
+        :param dirty_only: if True, only regenerate CERP when it is not
+            current (see :meth:`cerp_is_current`)
+        :returns: True if CERP was regenerated
         '''
+        if dirty_only and self.cerp_is_current():
+            return False
         self.cerp.content = cerp.Message.from_email_message(self.mime_data.content)
+        self._set_cerp_hash()
+        return True
+
+    def mime_checksum(self):
+        '''Checksum of the current :attr:`mime_data`, as a tuple of hash
+        function name (as used in CERP) and value.  Uses the checksum
+        from the datastream profile when available; otherwise,
+        calculates an MD5 checksum of the content.  Returns None if
+        there is no MIME data.'''
+        ds = self.mime_data
+        if not ds.exists and ds._content is None:
+            return None
+        if ds.exists and not ds.isModified() and ds.checksum \
+               and ds.checksum != 'none':
+            # fedora checksum types are formatted like SHA-256; cerp uses SHA256
+            return ds.checksum_type.replace('-', '').upper(), ds.checksum
+        return 'MD5', hashlib.md5(ds._raw_content()).hexdigest()
+
+    def cerp_is_current(self):
+        '''Check if :attr:`cerp` was generated from the current
+        :attr:`mime_data`, based on the MIME checksum stored in the
+        CERP message hash.'''
+        if not self.cerp.exists and self.cerp._content is None:
+            return False
+        stored = self.cerp.content.hash
+        if stored is None or not stored.value:
+            return False
+        checksum = self.mime_checksum()
+        return checksum is not None and (stored.function, stored.value) == checksum
+
+    def _set_cerp_hash(self):
+        # store the checksum of the mime data cerp was generated from
+        checksum = self.mime_checksum()
+        if checksum is None:
+            return
+        function, value = checksum
+        if self.cerp.content.hash is None:
+            self.cerp.content.create_hash()
+        self.cerp.content.hash.function = function
+        self.cerp.content.hash.value = value
 
 
 ### basic file object
@@ -183,6 +556,14 @@ class RushdieFile(Arrangement):
     # NOTE: first batch of messages created (Performa 5400) have rels-ext
     # relations in both directions, but we are not preserving that.
 
+    def verify_fixity(self, chunk_size=CHUNK_SIZE):
+        '''Compare the MD5 checksum of the :attr:`original` content,
+        streamed from Fedora in chunks, with the checksum in
+        :attr:`filetech`.  Returns a :class:`~eulcm.fixity.FixityResult`;
+        see :func:`eulcm.fixity.verify_fixity` for checking many
+        objects.'''
+        return check_fixity(self.api, self.pid, chunk_size)
+
 
 
 
@@ -0,0 +1,213 @@
+# file eulcm/models/collection/tree.py
+#
+#   Copyright 2012 Emory University Libraries
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+In-memory collection hierarchy, for navigating nested collections
+(related via *isMemberOfCollection*) without resolving the
+:attr:`collection` relation one object at a time.
+
+The full hierarchy for a collection content model is loaded with a
+single Resource Index query and cached; subtrees and ancestor chains
+are then calculated in memory.
+
+'''
+
+from eulfedora.rdfns import model, relsext
+
+from eulcm.cache import LRUCache
+from eulcm.fetch import FEDORA_LABEL, uri_to_pid
+
+
+class CollectionNode(object):
+    '''A single collection in a :class:`CollectionTree`.
+
+    :param pid: collection pid
+    :param label: collection object label
+    '''
+    __slots__ = ('pid', 'label', 'parent', 'children')
+
+    def __init__(self, pid, label=None):
+        self.pid = pid
+        self.label = label
+        self.parent = None
+        'parent :class:`CollectionNode`, or None for top-level collections'
+        self.children = []
+        'list of child :class:`CollectionNode`, sorted by label and pid'
+
+    def __repr__(self):
+        return '<CollectionNode %s>' % self.pid
+
+    def ancestors(self):
+        '''List of ancestor nodes, starting with the top-level
+        collection and ending with the parent of this node.'''
+        ancestors = []
+        node = self.parent
+        # guard against cycles in the relations
+        while node is not None and node is not self and node not in ancestors:
+            ancestors.append(node)
+            node = node.parent
+        ancestors.reverse()
+        return ancestors
+
+    def descendants(self):
+        'Generator returning all nodes below this one, depth-first.'
+        stack = list(reversed(self.children))
+        seen = set([self.pid])
+        while stack:
+            node = stack.pop()
+            if node.pid in seen:
+                continue
+            seen.add(node.pid)
+            yield node
+            stack.extend(reversed(node.children))
+
+
+class CollectionTree(object):
+    '''Collection hierarchy built from (pid, parent pid, label) tuples.
+    Parents that are not themselves in the list (e.g., objects of a
+    different type) are ignored, so their members are top-level
+    collections in the tree.'''
+
+    def __init__(self, relations):
+        self.nodes = {}
+        'dictionary of pid -> :class:`CollectionNode`'
+        parents = {}
+        for pid, parent, label in relations:
+            node = self.nodes.get(pid)
+            if node is None:
+                node = self.nodes[pid] = CollectionNode(pid, label)
+            elif label and not node.label:
+                node.label = label
+            if parent is not None:
+                # objects with multiple parents keep the first
+                parents.setdefault(pid, parent)
+
+        self.roots = []
+        'list of top-level :class:`CollectionNode`'
+        for pid, node in self.nodes.items():
+            parent = self.nodes.get(parents.get(pid))
+            if parent is not None and parent is not node:
+                node.parent = parent
+                parent.children.append(node)
+            else:
+                self.roots.append(node)
+
+        sort_key = lambda node: (node.label or '', node.pid)
+        self.roots.sort(key=sort_key)
+        for node in self.nodes.values():
+            node.children.sort(key=sort_key)
+
+    def __contains__(self, pid):
+        return pid in self.nodes
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def get(self, pid):
+        ':class:`CollectionNode` for a pid, or None if not in the tree.'
+        return self.nodes.get(pid)
+
+    def ancestors(self, pid):
+        '''List of ancestor nodes for a pid, starting at the top level;
+        empty if the pid is not in the tree.'''
+        node = self.nodes.get(pid)
+        return node.ancestors() if node is not None else []
+
+    def subtree(self, pid):
+        '''List of pids for a collection and all of its descendants;
+        empty if the pid is not in the tree.'''
+        node = self.nodes.get(pid)
+        if node is None:
+            return []
+        return [node.pid] + [n.pid for n in node.descendants()]
+
+
+_tree_cache = LRUCache(maxsize=16, ttl=300)
+# collection trees, keyed on (fedora base url, content model uri)
+
+
+def load_collection_tree(risearch, content_model, use_cache=True):
+    '''Load the :class:`CollectionTree` for all collections with the
+    specified content model, using a single Resource Index query.
+    Trees are cached for a few minutes; see
+    :func:`invalidate_collection_tree`.
+
+    :param risearch: :class:`eulfedora.api.ResourceIndex`
+    :param content_model: collection content model URI
+    :param use_cache: if False, always query the Resource Index
+    '''
+    key = (risearch.base_url, content_model)
+    tree = _tree_cache.get(key) if use_cache else None
+    if tree is None:
+        query = '''SELECT ?pid ?parent ?label WHERE {
+            ?pid <%(hasModel)s> <%(cmodel)s> .
+            OPTIONAL { ?pid <%(rel)s> ?parent }
+            OPTIONAL { ?pid <%(label)s> ?label }
+        }''' % {'hasModel': model.hasModel, 'cmodel': content_model,
+                'rel': relsext.isMemberOfCollection, 'label': FEDORA_LABEL}
+        tree = CollectionTree(
+            (uri_to_pid(r['pid']),
+             uri_to_pid(r['parent']) if r.get('parent') else None,
+             r.get('label') or None)
+            for r in risearch.sparql_query(query))
+        _tree_cache.set(key, tree)
+    return tree
+
+
+def invalidate_collection_tree(content_model=None, base_url=None):
+    '''Discard cached collection trees, e.g. after collections are
+    added, removed or moved.  By default, all trees are discarded.
+
+    :param content_model: only discard trees for this content model
+    :param base_url: only discard trees for the Fedora repository
+        with this base url
+    '''
+    if content_model is None and base_url is None:
+        _tree_cache.clear()
+        return
+    for key in _tree_cache.keys():
+        if content_model in (None, key[1]) and base_url in (None, key[0]):
+            _tree_cache.pop(key)
+
+
+class CollectionHierarchy(object):
+    '''Mixin for collection :class:`~eulfedora.models.DigitalObject`
+    classes with a ``COLLECTION_CONTENT_MODEL``, to navigate the
+    collection hierarchy from a cached :class:`CollectionTree`.  Saving
+    a collection invalidates the cached tree for its content model and
+    repository.'''
+
+    def collection_tree(self, use_cache=True):
+        ':class:`CollectionTree` for all collections of this type.'
+        return load_collection_tree(self.risearch, self.COLLECTION_CONTENT_MODEL,
+                                    use_cache)
+
+    def collection_ancestors(self, use_cache=True):
+        '''List of :class:`CollectionNode` for the collections this
+        collection is nested in, starting at the top level (e.g., for
+        breadcrumbs).'''
+        return self.collection_tree(use_cache).ancestors(self.pid)
+
+    def collection_subtree(self, use_cache=True):
+        ''':class:`CollectionNode` for this collection, with its
+        nested subcollections as children; None if the collection is
+        not in the Resource Index.'''
+        return self.collection_tree(use_cache).get(self.pid)
+
+    def save(self, *args, **kwargs):
+        result = super(CollectionHierarchy, self).save(*args, **kwargs)
+        invalidate_collection_tree(self.COLLECTION_CONTENT_MODEL, self.api.base_url)
+        return result
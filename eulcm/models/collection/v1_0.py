@@ -17,16 +17,20 @@
 
 from eulfedora.models import DigitalObject, XmlDatastream, Relation
 from eulfedora.rdfns import relsext
-from eulxml.xmlmap import mods
+
+from eulcm.cache import IdentityMapped
+from eulcm.models.collection.tree import CollectionHierarchy
 
 # TODO: make control pidspace configurable
 
-class Collection(DigitalObject):
+class Collection(CollectionHierarchy, IdentityMapped, DigitalObject):
     '''
     Fedora Collection 1.0.  Implicit collection with Dublin Core
     descriptive metadata. Objects that belong to collection 1.1 objects are
     expected to be related to via *isMemberOfCollection*.  Could be a
-    sub-collection of another Collection 1.0.
+    sub-collection of another Collection 1.0; see
+    :class:`~eulcm.models.collection.tree.CollectionHierarchy` for
+    navigating nested collections.
     '''
     COLLECTION_CONTENT_MODEL = 'info:fedora/emory-control:Collection-1.0'
     'content model'
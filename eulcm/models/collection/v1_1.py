@@ -17,17 +17,21 @@
 
 from eulfedora.models import DigitalObject, XmlDatastream, Relation
 from eulfedora.rdfns import relsext
-from eulxml.xmlmap import mods
+from eulxml.xmlmap import load_xmlobject_from_string, mods
 
+from eulcm.cache import IdentityMapped
+from eulcm.models.collection.tree import CollectionHierarchy
 from eulcm.xmlmap.mods import MODS
 
 
-class Collection(DigitalObject):
+class Collection(CollectionHierarchy, IdentityMapped, DigitalObject):
     '''
     Fedora Collection 1.1.  Implicit collection with MODS descriptive
     metadata.  Objects that belong to collection 1.1 objects are
     expected to be related to via *isMemberOfCollection*.  Could be a
-    sub-collection of another Collection 1.1.
+    sub-collection of another Collection 1.1; see
+    :class:`~eulcm.models.collection.tree.CollectionHierarchy` for
+    navigating nested collections.
     '''
     COLLECTION_CONTENT_MODEL = 'info:fedora/emory-control:Collection-1.1'
     'content model'
@@ -48,3 +52,51 @@ class Collection(DigitalObject):
     via `isMemberOfCollection` relation, for subcollections.
     '''
 
+    def member_access(self, allowed_codes, workers=None, cache=None):
+        '''Evaluate access for all objects that are members of this
+        collection (via `isMemberOfCollection`), retrieving their
+        ``Rights`` datastreams concurrently.  Returns a dictionary of
+        pid -> :class:`~eulcm.xmlmap.boda.AccessDecision`.  Members
+        without Rights metadata are included, with no access allowed.
+
+        :param allowed_codes: access status codes that allow access; see
+            :meth:`eulcm.xmlmap.boda.Rights.access_decision`
+        :param workers: maximum number of concurrent requests; defaults
+            to :data:`eulcm.fetch.DEFAULT_WORKERS`
+        :param cache: optional :class:`eulcm.cache.AccessCache` to be
+            updated with the results, along with the Rights datastream
+            versions they were based on
+        '''
+        # imported here rather than at module level, since they are
+        # only needed for bulk rights evaluation; eulcm.models.boda
+        # also imports this module
+        from eulcm.fetch import DEFAULT_WORKERS, datastream_version, \
+             fetch_datastreams, fetch_profiles, uri_to_pid
+        from eulcm.models.boda import Arrangement
+        from eulcm.xmlmap.boda import Rights
+
+        if workers is None:
+            workers = DEFAULT_WORKERS
+        dsid = Arrangement.rights.id
+        pids = [uri_to_pid(uri) for uri in
+                self.risearch.get_subjects(relsext.isMemberOfCollection, self.uriref)]
+        versions = {}
+        if cache is not None:
+            # profiles are retrieved before content, so a datastream
+            # modified in between is checked again rather than cached
+            # with an outdated version
+            profiles = fetch_profiles(self.api, pids, dsid, workers)
+            versions = dict((pid, datastream_version(profile))
+                            for pid, profile in profiles.items() if profile is not None)
+            pids_with_rights = [pid for pid in pids if pid in versions]
+        else:
+            pids_with_rights = pids
+        content = fetch_datastreams(self.api, pids_with_rights, [dsid], workers)
+        decisions = {}
+        for pid in pids:
+            data = content.get((pid, dsid))
+            rights = load_xmlobject_from_string(data, Rights) if data else Rights()
+            decisions[pid] = rights.access_decision(allowed_codes)
+            if cache is not None:
+                cache.set(pid, rights, version=versions.get(pid))
+        return decisions
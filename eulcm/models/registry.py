@@ -0,0 +1,163 @@
+# file eulcm/models/registry.py
+#
+#   Copyright 2012 Emory University Libraries
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+Registry of eulcm content model classes, for choosing the most
+specific :class:`~eulfedora.models.DigitalObject` class for an object
+from its content models (e.g.,
+:class:`~eulcm.models.boda.EmailMessage` rather than
+:class:`~eulcm.models.boda.Arrangement`), and for classifying many
+objects at once from their ``RELS-EXT`` datastreams.
+
+'''
+
+import threading
+
+from eulfedora.rdfns import model
+from lxml import etree
+
+from eulcm.fetch import DEFAULT_WORKERS, fetch_datastreams, uri_to_pid
+from eulcm.models import model_classes
+
+
+_HAS_MODEL = etree.XPath('//fedora-model:hasModel/@rdf:resource', namespaces={
+    'rdf': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#',
+    'fedora-model': str(model),
+})
+
+def rels_ext_content_models(data):
+    '''Set of content model URIs from ``RELS-EXT`` RDF/XML content.'''
+    return frozenset(_HAS_MODEL(etree.fromstring(data)))
+
+
+class ContentModelRegistry(object):
+    '''Mapping from sets of content models to the most specific
+    registered class.  The matching rule is the same as
+    :meth:`eulfedora.server.Repository.best_subtype_for_object`: the
+    class that requires the most content models, all of which the
+    object has.  Classes are indexed by content model and results are
+    remembered per set of content models, so repeated lookups are a
+    single dictionary access.
+
+    :param classes: optional list of classes to register; by default,
+        all classes listed in :data:`eulcm.models.MODEL_CLASSES` are
+        loaded and registered on first use
+    '''
+
+    def __init__(self, classes=None):
+        self._by_cmodel = {}
+        self._matches = {}
+        self._lock = threading.Lock()
+        self._loaded = classes is not None
+        for cls in classes or []:
+            self.register(cls)
+
+    def _load_defaults(self):
+        with self._lock:
+            if not self._loaded:
+                for cls in model_classes():
+                    self._register(cls)
+                self._loaded = True
+
+    def register(self, cls):
+        '''Register a :class:`~eulfedora.models.DigitalObject` subclass
+        with ``CONTENT_MODELS``.'''
+        with self._lock:
+            self._register(cls)
+
+    def _register(self, cls):
+        for uri in cls.CONTENT_MODELS:
+            classes = self._by_cmodel.setdefault(str(uri), [])
+            if cls not in classes:
+                classes.append(cls)
+        self._matches.clear()
+
+    def best_class(self, content_models):
+        '''Most specific registered class for a set of content model
+        URIs, or None if no registered class matches.'''
+        if not self._loaded:
+            self._load_defaults()
+        key = frozenset(str(uri) for uri in content_models)
+        try:
+            return self._matches[key]
+        except KeyError:
+            pass
+
+        match_len, matches = 0, []
+        candidates = set()
+        for uri in key:
+            candidates.update(self._by_cmodel.get(uri, []))
+        for cls in candidates:
+            required = set(cls.CONTENT_MODELS)
+            if required.issubset(key):
+                if len(required) > match_len:
+                    match_len, matches = len(required), [cls]
+                elif len(required) == match_len:
+                    matches.append(cls)
+
+        best = None
+        if matches:
+            # prefer a class that is a subclass of all the others; fall
+            # back to a consistent choice
+            matches.sort(key=lambda cls: (cls.__module__, cls.__name__))
+            best = matches[0]
+            for cls in matches:
+                if all(issubclass(cls, other) for other in matches):
+                    best = cls
+                    break
+        self._matches[key] = best
+        return best
+
+    def classify(self, api, pids, workers=DEFAULT_WORKERS):
+        '''Find the most specific registered class for each of a list
+        of objects, retrieving only their ``RELS-EXT`` datastreams
+        (concurrently).  Returns a dictionary of pid -> class; objects
+        without RELS-EXT or without a matching class map to None.
+
+        :param api: :class:`eulfedora.api.REST_API` instance
+        :param pids: list of pids or object URIs
+        :param workers: maximum number of concurrent requests
+        '''
+        pids = [uri_to_pid(pid) for pid in pids]
+        content = fetch_datastreams(api, pids, ['RELS-EXT'], workers)
+        classes = {}
+        for pid in pids:
+            data = content.get((pid, 'RELS-EXT'))
+            if data:
+                classes[pid] = self.best_class(rels_ext_content_models(data))
+            else:
+                classes[pid] = None
+        return classes
+
+    def get_objects(self, repo, pids, workers=DEFAULT_WORKERS):
+        '''Initialize objects as their most specific registered class;
+        see :meth:`classify`.  Objects without a matching class are
+        returned as :class:`~eulfedora.models.DigitalObject`.
+
+        :param repo: :class:`eulfedora.server.Repository`
+        :param pids: list of pids
+        :param workers: maximum number of concurrent requests
+        :returns: list of objects, in the same order as the pids
+        '''
+        from eulfedora.models import DigitalObject
+        classes = self.classify(repo.api, pids, workers)
+        return [repo.get_object(uri_to_pid(pid),
+                                type=classes[uri_to_pid(pid)] or DigitalObject)
+                for pid in pids]
+
+
+registry = ContentModelRegistry()
+'''Default :class:`ContentModelRegistry` with all eulcm classes.'''
@@ -0,0 +1,79 @@
+# file eulcm/report.py
+#
+#   Copyright 2012 Emory University Libraries
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+
+'''
+Resumable CSV reports for long-running batch jobs, such as fixity
+audits (:class:`eulcm.fixity.FixityReport`) and bulk ingest
+(:class:`eulcm.ingest.IngestCheckpoint`).
+
+'''
+
+import csv
+import os
+
+
+class CsvReport(object):
+    '''Results stored in a CSV file, one row per result.  Rows are
+    appended and flushed as results are recorded, so an interrupted job
+    can be resumed with the same file.  Subclasses set :attr:`RESULT`
+    and extend :meth:`_update` to track results that do not need to be
+    processed again; it is called for each result already in the file
+    when the report is opened, and for each new result.
+
+    :param filename: report file; created if it does not exist
+    '''
+
+    RESULT = None
+    'namedtuple class for results; its fields are the CSV columns'
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = None
+        self._needs_header = not os.path.exists(filename) or \
+                             os.path.getsize(filename) == 0
+        if not self._needs_header:
+            for result in self.results():
+                self._update(result)
+
+    def results(self):
+        'Generator returning all results in the report.'
+        if self._needs_header:
+            return
+        with open(self.filename, newline='') as report:
+            for row in csv.DictReader(report):
+                yield self.RESULT(*[row.get(field) or None for field in self.RESULT._fields])
+
+    def _update(self, result):
+        pass
+
+    def record(self, result):
+        'Add a result to the report.'
+        if self._file is None:
+            self._file = open(self.filename, 'a', newline='')
+            self._writer = csv.writer(self._file)
+            if self._needs_header:
+                self._writer.writerow(self.RESULT._fields)
+                self._needs_header = False
+        self._writer.writerow(['' if value is None else value for value in result])
+        self._file.flush()
+        self._update(result)
+
+    def close(self):
+        'Close the report file.'
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -24,11 +24,21 @@ models which are currently in use, but are intended to be migrated.
 '''
 
 
+from collections import namedtuple
+import calendar
+import datetime
+import threading
+import weakref
+
+from lxml import etree
+
 from eulxml import xmlmap
 from eulxml.xmlmap import mods
 
+from eulcm.xmlmap.core import CachedXmlObject
 
-class _BaseRights(xmlmap.XmlObject):
+
+class _BaseRights(CachedXmlObject):
     'Base class for Rights metadata objects'
     ROOT_NS = 'http://pid.emory.edu/ns/2010/rights'
     'xml namespace'
@@ -84,9 +94,63 @@ class Rights(_BaseRights):
         help_text='Additional information about the intellectual property rights of the associated work.')
     # NOTE: eventually should be repeatable/StringListField
 
-
-
-class Series_Base(mods.RelatedItem):
+    def access_decision(self, allowed_codes, today=None):
+        '''Evaluate this rights metadata and return an
+        :class:`AccessDecision`.  Access is allowed when the
+        :attr:`access_status` code is one of the specified codes and
+        :attr:`block_external_access` is not set.  An expired access
+        restriction is reported but does not by itself allow access.
+        The expiration date is the last day of the restriction, so it
+        has expired after that date; a partial expiration date such as
+        ``2020`` or ``2020-06`` expires after the end of the year or
+        month.
+
+        :param allowed_codes: access status codes that allow access
+        :param today: date to use for checking restriction expiration;
+            defaults to the current date
+        '''
+        code = self.access_status.code if self.access_status is not None else None
+        blocked = bool(self.block_external_access)
+        expiration = parse_w3cdtf(self.access_restriction_expiration, end=True)
+        if today is None:
+            today = datetime.date.today()
+        return AccessDecision(code=code,
+            allowed=code in allowed_codes and not blocked,
+            blocked=blocked, expiration=expiration,
+            expired=expiration is not None and expiration < today)
+
+
+AccessDecision = namedtuple('AccessDecision', ['code', 'allowed', 'blocked',
+                                               'expiration', 'expired'])
+'''Result of :meth:`Rights.access_decision`: access status code,
+whether access is allowed, whether external access is blocked, access
+restriction expiration date (:class:`datetime.date` or None), and
+whether the restriction has expired.'''
+
+
+def parse_w3cdtf(value, end=False):
+    '''Parse a W3C date (``YYYY``, ``YYYY-MM``, ``YYYY-MM-DD``, or a
+    full date and time) as a :class:`datetime.date`.  Partial dates
+    are treated as the first day of the year or month, or as the last
+    day if ``end`` is True (e.g., for an expiration date, where a
+    restriction through ``2020`` should last until the end of 2020).
+    Returns None for empty or unparseable values.'''
+    if not value:
+        return None
+    parts = value.strip()[:10].split('-')
+    try:
+        parts = [int(p) for p in parts]
+        if len(parts) == 1:
+            parts += [12, 31] if end else [1, 1]
+        elif len(parts) == 2:
+            parts.append(calendar.monthrange(*parts)[1] if end else 1)
+        return datetime.date(*parts[:3])
+    except (ValueError, TypeError):
+        return None
+
+
+
+class Series_Base(CachedXmlObject, mods.RelatedItem):
     '''Base class for Series information; subclass of
     :class:`eulxml.xmlmap.mods.RelatedItem`.'''
 
@@ -106,6 +170,15 @@ class Series_Base(mods.RelatedItem):
             required=False, verbose_name='short id of this node')
     'short id'
 
+    def series_key(self):
+        'Series information as a hashable :class:`SeriesKey`.'
+        return SeriesKey(self.full_id, self.short_id, self.title,
+                         self.uri, self.base_ark)
+
+SeriesKey = namedtuple('SeriesKey', ['full_id', 'short_id', 'title', 'uri', 'base_ark'])
+'''Identifying information for a series or subseries, as returned by
+:meth:`ArrangementMods.series_info`.'''
+
 # FIXME: what is the difference between series 1 and 2?
 
 class Series2(Series_Base):
@@ -120,7 +193,7 @@ class Series1(Series_Base):
         required=False,
         help_text='subseries')
 
-class ArrangementMods(mods.MODS):
+class ArrangementMods(CachedXmlObject, mods.MODS):
     '''Subclass of :class:`eulxml.xmlmap.mods.MODS` with mapping for
     series information.'''
     series = xmlmap.NodeField("mods:relatedItem[@type='series']", Series1,
@@ -128,6 +201,19 @@ class ArrangementMods(mods.MODS):
         help_text='series')
     'series'
 
+    def series_info(self):
+        '''Series and subseries, decoded from the storage convention
+        described below, as a tuple of (series, subseries)
+        :class:`SeriesKey`; either may be None.'''
+        series = self.series
+        key = series.series_key() if series is not None else None
+        if not any(key or ()):
+            return (None, None)
+        parent_key = series.series.series_key() if series.series is not None else None
+        if not any(parent_key or ()):
+            return (key, None)
+        return (parent_key, key)
+
 
 # NOTE: for series/subseries storage in arrangementmods:
 # - if series only, series info should be stored as mods.series
@@ -137,25 +223,203 @@ class ArrangementMods(mods.MODS):
 class DirPart(object):
     '''A DirPart represents a single path component in a file path.
 
+    DirPart instances are shared: creating a DirPart for a computer,
+    base path, and name that is already in use returns the existing
+    instance, so walking many files in the same directories does not
+    duplicate path components.
+
     :param computer: computer where this content is located
     :param base: path to this directory 
     :param name: name of this directory 
     '''
-
-    def __init__(self, computer, base, name):
-        self.computer = computer
-        self.base = base
-        self.name = name
+    __slots__ = ('computer', 'base', 'name', 'parent', '_path', '__weakref__')
+
+    # shared instances, keyed on (computer, base, name); entries are
+    # discarded once no longer referenced
+    _instances = weakref.WeakValueDictionary()
+    _lock = threading.Lock()
+
+    def __new__(cls, computer, base, name):
+        key = (computer, base, name)
+        inst = cls._instances.get(key)
+        if inst is not None:
+            return inst
+        # look up the parent before locking, since it may need to be created
+        parent = cls.for_path(computer, base)
+        with cls._lock:
+            inst = cls._instances.get(key)
+            if inst is None:
+                inst = super(DirPart, cls).__new__(cls)
+                inst.computer = computer
+                inst.base = base
+                inst.name = name
+                inst.parent = parent
+                inst._path = None
+                cls._instances[key] = inst
+        return inst
+
+    @classmethod
+    def for_path(cls, computer, path):
+        '''Get the :class:`DirPart` for a directory path on a computer,
+        e.g. ``/Hard Disk/Letters/``.  Returns None for the top-level
+        directory.'''
+        if path.endswith('/'):
+            path = path[:-1]
+        if not path:
+            return None
+        i = path.rfind('/')
+        return cls(computer, path[:i + 1], path[i + 1:])
 
     def __unicode__(self):
         return self.name
 
     def path(self):
         'full path for this item (combines computer, base path, and name)'
-        return '/' + self.computer + self.base + self.name + '/'
+        if self._path is None:
+            self._path = '/' + self.computer + self.base + self.name + '/'
+        return self._path
+
+    def chain(self):
+        '''Tuple of :class:`DirPart` instances from the top-level
+        directory down to and including this one.'''
+        parts = []
+        part = self
+        while part is not None:
+            parts.append(part)
+            part = part.parent
+        return tuple(reversed(parts))
         
 
-class FileMasterTech_Base(xmlmap.XmlObject):
+class DirectoryNode(object):
+    '''A single directory in a :class:`DirectoryIndex`.
+
+    :param name: name of this directory
+    '''
+    __slots__ = ('name', 'dirs', 'files', 'file_count', 'size')
+
+    def __init__(self, name):
+        self.name = name
+        self.dirs = {}
+        'subdirectories, as a dictionary of name -> :class:`DirectoryNode`'
+        self.files = []
+        'files directly in this directory'
+        self.file_count = 0
+        'total number of files in this directory and all subdirectories'
+        self.size = 0
+        '''total size of all files in this directory and all
+        subdirectories, for files added with a size'''
+
+
+class DirectoryIndex(object):
+    '''Prefix tree of file paths, grouped by computer, for browsing
+    the directory structure described in file technical metadata
+    without rescanning the full file list.  Lookups are proportional to
+    the depth of the requested directory.
+
+    :param files: optional iterable of :class:`FileMasterTech_Base` or
+        :class:`FileRecord` objects to add to the index
+    :param size: optional function called with each of the files,
+        returning its size in bytes (or None), to be included in
+        directory totals; without it, directory sizes are 0
+    '''
+
+    def __init__(self, files=None, size=None):
+        self.computers = {}
+        'dictionary of computer name -> root :class:`DirectoryNode`'
+        self.pathless = []
+        'files without a path, which are not in the directory tree'
+        if files is not None:
+            for f in files:
+                self.add(f, size(f) if size is not None else None)
+
+    def add(self, f, size=None):
+        '''Add a file to the index.  Files without a path are added to
+        :attr:`pathless` instead of the directory tree.
+
+        :param f: :class:`FileMasterTech_Base` or :class:`FileRecord`
+        :param size: optional file size, to be included in directory totals
+        '''
+        if not f.path:
+            self.pathless.append(f)
+            return
+        node = self.computers.get(f.computer)
+        if node is None:
+            node = self.computers[f.computer] = DirectoryNode(f.computer)
+        parts = f.path.split('/')
+        # path is absolute, so parts[0] is empty; last part is the filename
+        for part in parts[1:-1]:
+            node.file_count += 1
+            node.size += size or 0
+            child = node.dirs.get(part)
+            if child is None:
+                child = node.dirs[part] = DirectoryNode(part)
+            node = child
+        node.file_count += 1
+        node.size += size or 0
+        node.files.append(f)
+
+    def lookup(self, computer, path='/'):
+        '''Find the :class:`DirectoryNode` for a directory, or None if the
+        directory is not in the index.
+
+        :param computer: computer name
+        :param path: directory path, e.g. ``/Hard Disk/Letters/``
+            (defaults to the top-level directory for the computer)
+        '''
+        node = self.computers.get(computer)
+        for part in path.split('/'):
+            if node is None:
+                break
+            if part:
+                node = node.dirs.get(part)
+        return node
+
+    def lookup_dirpart(self, dirpart):
+        '''Find the :class:`DirectoryNode` corresponding to a
+        :class:`DirPart`.'''
+        return self.lookup(dirpart.computer, dirpart.base + dirpart.name)
+
+    def children(self, computer, path='/'):
+        '''Subdirectory names and files directly within a directory, as
+        a tuple of (sorted list of directory names, list of files).
+        Returns empty lists if the directory is not in the index.'''
+        node = self.lookup(computer, path)
+        if node is None:
+            return [], []
+        return sorted(node.dirs), list(node.files)
+
+
+class _FileMethods(object):
+    # common methods for file metadata objects that have computer and
+    # path attributes (FileMasterTech_Base and FileRecord)
+    __slots__ = ()
+
+    def browsable(self):
+        '''Check if this file is browsable, based on :attr:`computer`
+        and the list of :attr:`BROWSABLE_COMPUTERS`.'''
+        return self.computer in self.BROWSABLE_COMPUTERS
+
+    def dir_parts(self):
+        '''
+        Directory parts based on path.  Returns an iterator of :class:`DirPart` instances
+        for each portion of the :attr:`path`.   
+        '''
+        return iter(self.dir_chain())
+
+    def dir_chain(self):
+        '''Tuple of :class:`DirPart` instances for the directories
+        containing this file, from the top-level directory down.'''
+        # path is absolute; everything before the last / is the directory
+        path = self.path
+        parent = DirPart.for_path(self.computer, path[:path.rfind('/') + 1])
+        return parent.chain() if parent is not None else ()
+
+    def name(self):
+        '''file name (last portion of the file path)'''
+        return self.path.split('/')[-1]
+
+
+class FileMasterTech_Base(_FileMethods, CachedXmlObject):
     '''Base class for technical file metadata'''
     
     ROOT_NS = 'http://pid.emory.edu/ns/2011/filemastertech'
@@ -189,33 +453,39 @@ class FileMasterTech_Base(xmlmap.XmlObject):
     creator = xmlmap.StringField('fs:creator')
     'creator'
 
-    def browsable(self):
-        '''Check if this file is browsable, based on :attr:`computer`
-        and the list of :attr:`BROWSABLE_COMPUTERS`.'''
-        return self.computer in self.BROWSABLE_COMPUTERS
 
-    def dir_parts(self):
-        '''
-        Directory parts based on path.  Generator returning :class:`DirPart` instances
-        for each portion of the :attr:`path`.   
-        '''
-        # FIXME: redundant code with rushdie webapp ?
-        # TODO: document what this actually does...
-        
-        raw_parts = self.path.split('/')
+_FILE_FIELDS = ('local_id', 'md5', 'computer', 'path', 'rawpath',
+                'attributes', 'created', 'modified', 'type', 'creator')
 
-        base = '/'
-        # path is absolute, so raw_parts[0] is empty. skip it. also skip
-        # raw_parts[-1] for special handling later
-        for part in raw_parts[1:-1]:
-            yield DirPart(self.computer, base, part)
-            base = base + part + '/'
+class FileRecord(_FileMethods, namedtuple('FileRecord', _FILE_FIELDS)):
+    '''Compact, read-only tuple version of :class:`FileMasterTech_Base`,
+    with the same attributes and methods, for use when reading file
+    metadata in bulk.  See :meth:`FileMasterTech.file_records`.'''
+    __slots__ = ()
 
-    def name(self):
-        '''file name (last portion of the file path)'''
-        return self.path.split('/')[-1]
+    BROWSABLE_COMPUTERS = FileMasterTech_Base.BROWSABLE_COMPUTERS
 
-class FileMasterTech(xmlmap.XmlObject):
+    # map xml tag names to field positions, based on the fields
+    # defined on FileMasterTech_Base
+    _tag_index = dict(
+        ('{%s}%s' % (FileMasterTech_Base.ROOT_NS,
+                     FileMasterTech_Base._fields[name].xpath.split(':')[-1]), i)
+        for i, name in enumerate(_FILE_FIELDS))
+
+    @classmethod
+    def from_node(cls, node):
+        '''Initialize a :class:`FileRecord` from an ``fs:file`` element
+        in a single pass over its child elements.'''
+        values = [None] * len(cls._fields)
+        for child in node.iterchildren(tag=etree.Element):
+            i = cls._tag_index.get(child.tag)
+            # first match wins, as with xpath-based field access
+            if i is not None and values[i] is None:
+                values[i] = ''.join(child.itertext())
+        return cls(*values)
+
+
+class FileMasterTech(CachedXmlObject):
     ''':class:`~eulxml.models.XmlObject` for representing technical
     file metadata'''
     
@@ -225,4 +495,50 @@ class FileMasterTech(xmlmap.XmlObject):
     file = xmlmap.NodeListField("fs:file", FileMasterTech_Base,
                                 required=False)		# why separate? 
     'file information; instance of :class:`FileMasterTech_Base`'  
-    
+
+    def file_records(self):
+        '''List of :class:`FileRecord` for every ``fs:file`` in this
+        document, with all fields read in a single pass.  Faster than
+        accessing the same attributes on :attr:`file` when reporting
+        on all of the files in a document.'''
+        file_tag = '{%s}%s' % (self.ROOT_NS, FileMasterTech_Base.ROOT_NAME)
+        return [FileRecord.from_node(node)
+                for node in self.node.iterchildren(tag=file_tag)]
+
+    def directory_index(self, size=None):
+        '''Build a :class:`DirectoryIndex` of all the files in this
+        document.
+
+        :param size: optional function called with each
+            :class:`FileRecord`, returning the file size for directory
+            totals; see :class:`DirectoryIndex`
+        '''
+        return DirectoryIndex(self.file_records(), size)
+
+    @classmethod
+    def iterfiles(cls, source, records=False):
+        '''Generator returning a :class:`FileMasterTech_Base` for each
+        ``fs:file`` in a FileMasterTech document, parsed incrementally
+        so that the full document is never held in memory.  Each file
+        element is detached from the document as soon as it has been
+        parsed, so memory use stays constant unless the caller holds
+        on to the returned objects.
+
+        :param source: filename or file-like object with FileMasterTech xml
+        :param records: if True, return :class:`FileRecord` tuples
+            instead of :class:`FileMasterTech_Base`; the xml for each
+            file is discarded as soon as it has been read
+        '''
+        file_tag = '{%s}%s' % (cls.ROOT_NS, FileMasterTech_Base.ROOT_NAME)
+        for event, node in etree.iterparse(source, events=('end',), tag=file_tag):
+            # remove the element from the partial tree built by the
+            # parser; the returned xml object keeps its own reference
+            parent = node.getparent()
+            if parent is not None:
+                parent.remove(node)
+            if records:
+                record = FileRecord.from_node(node)
+                node.clear()
+                yield record
+            else:
+                yield FileMasterTech_Base(node)
@@ -0,0 +1,255 @@
+# file eulcm/xmlmap/core.py
+#
+#   Copyright 2012 Emory University Libraries
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+Common base class for eulcm :class:`~eulxml.xmlmap.XmlObject`
+subclasses, with faster access to single-valued fields.
+
+'''
+
+import threading
+
+from lxml import etree
+
+from eulxml import xmlmap
+from eulxml.xmlmap.core import XmlObjectType
+from eulxml.xmlmap.fields import Field, NodeMapper, SingleNodeManager
+
+
+_write_lock = threading.Lock()
+# generation counters per xml document, keyed on the id of the root
+# element, incremented whenever the document is modified through a
+# field on a CachedXmlObject; memoized values keep a reference to the
+# root element, so the id is not reused while they are in use
+_generations = {}
+# maximum number of documents with counters; when reached, all
+# counters are discarded and the epoch is incremented, which discards
+# all memoized values
+_MAX_DOCUMENTS = 10000
+_epoch = [0]
+
+# compiled xpaths, keyed on xpath and namespace items
+_compiled_xpaths = {}
+
+def _document_state(root):
+    return _epoch[0], _generations.get(id(root), 0)
+
+def _invalidate(node):
+    root = node.getroottree().getroot()
+    with _write_lock:
+        if len(_generations) >= _MAX_DOCUMENTS:
+            _generations.clear()
+            _epoch[0] += 1
+        key = id(root)
+        _generations[key] = _generations.get(key, 0) + 1
+
+
+def _first_step(xpath):
+    # first location step of a relative xpath, without predicates
+    # (e.g. mods:identifier for mods:identifier[@type="ark"]/text());
+    # None if the xpath is not a simple path starting from a named
+    # child, attribute, or text node
+    step = []
+    depth = 0
+    quote = None
+    for char in xpath.strip():
+        if quote is not None:
+            if char == quote:
+                quote = None
+        elif char in '\'"':
+            quote = char
+        elif char == '[':
+            depth += 1
+        elif char == ']':
+            depth -= 1
+        elif depth == 0:
+            if char == '/':
+                break
+            if char == '|':
+                return None
+            step.append(char)
+    step = ''.join(step).strip()
+    if not step or step in ('.', '..') or '::' in step or '*' in step or \
+           ('(' in step and step != 'text()'):
+        return None
+    return step
+
+
+def _is_simple(field):
+    # single-valued field that maps to a python value rather than an
+    # xml object
+    manager = getattr(field, 'manager', None)
+    return isinstance(manager, SingleNodeManager) and \
+           not manager.instantiate_on_get and \
+           not isinstance(getattr(field, 'mapper', None), NodeMapper)
+
+
+def _evaluate(field, node, namespaces):
+    # value of a simple field, using a precompiled xpath; same logic as
+    # eulxml.xmlmap.fields._find_xml_node
+    key = (field.xpath, namespaces)
+    xpath = _compiled_xpaths.get(key)
+    if xpath is None:
+        xpath = _compiled_xpaths[key] = etree.XPath(key[0], namespaces=dict(key[1]))
+    matches = xpath(node)
+    if matches and isinstance(matches, list):
+        match = matches[0]
+    elif matches:
+        match = matches
+    else:
+        match = None
+    return field.mapper.to_python(match)
+
+
+class _FieldDescriptor(object):
+    # field descriptor that invalidates memoized values for the
+    # document when the field is modified; replaces the eulxml field
+    # descriptor for fields that are not memoized, evaluating simple
+    # fields with a precompiled xpath
+
+    def __init__(self, name, field):
+        self.name = name
+        self.field = field
+        self.simple = _is_simple(field)
+
+    def __get__(self, obj, objtype):
+        if obj is None:
+            # return the field, as eulxml does, for introspection and docs
+            return self.field
+        if not self.simple or set(obj.context) != set(['namespaces']):
+            return self.field.get_for_node(obj.node, obj.context)
+        return _evaluate(self.field, obj.node, obj._field_memo()['__namespaces__'])
+
+    def __set__(self, obj, value):
+        _invalidate(obj.node)
+        return self.field.set_for_node(obj.node, obj.context, value)
+
+    def __delete__(self, obj):
+        _invalidate(obj.node)
+        return self.field.delete_for_node(obj.node, obj.context)
+
+
+class _CachedFieldDescriptor(_FieldDescriptor):
+    # field descriptor that evaluates a precompiled xpath and memoizes
+    # the result on the instance
+
+    def __get__(self, obj, objtype):
+        if obj is None:
+            return self.field
+        memo = obj._field_memo()
+        try:
+            return memo[self.name]
+        except KeyError:
+            pass
+
+        if set(obj.context) != set(['namespaces']):
+            # unusual xpath context; use standard field handling
+            value = self.field.get_for_node(obj.node, obj.context)
+        else:
+            value = _evaluate(self.field, obj.node, memo['__namespaces__'])
+        memo[self.name] = value
+        return value
+
+
+def _cached_create(name, field):
+    # create_<field> method that invalidates memoized values
+    def create_field(xmlobject):
+        _invalidate(xmlobject.node)
+        field.create_for_node(xmlobject.node, xmlobject.context)
+    create_field.__name__ = str(name)
+    return create_field
+
+
+class _CachedXmlObjectType(XmlObjectType):
+    # extends the eulxml metaclass to replace descriptors for all
+    # fields (including inherited fields), memoizing values for simple
+    # fields declared on CachedXmlObject classes
+
+    def __new__(cls, name, bases, defined_attrs):
+        new_class = super(_CachedXmlObjectType, cls).__new__(cls, name, bases, defined_attrs)
+        declared = set(attr for attr, value in defined_attrs.items()
+                       if isinstance(value, Field))
+        for base in bases:
+            declared.update(getattr(base, '_declared_fields', ()))
+        new_class._declared_fields = frozenset(declared)
+
+        # node and list fields return objects that modify the xml
+        # without going through a descriptor, so values are not
+        # memoized for fields that could be affected by them
+        shared_steps = set(_first_step(field.xpath)
+                           for field in new_class._fields.values()
+                           if not _is_simple(field))
+        memoized = set()
+        if None not in shared_steps:
+            for field_name in declared:
+                field = new_class._fields[field_name]
+                step = _first_step(field.xpath)
+                if _is_simple(field) and step is not None and step not in shared_steps:
+                    memoized.add(field_name)
+        new_class._memoized_fields = frozenset(memoized)
+
+        for field_name, field in new_class._fields.items():
+            descriptor = _CachedFieldDescriptor if field_name in memoized \
+                         else _FieldDescriptor
+            setattr(new_class, field_name, descriptor(field_name, field))
+            if hasattr(field, 'create_for_node'):
+                create_name = 'create_' + field_name
+                setattr(new_class, create_name, _cached_create(create_name, field))
+        return new_class
+
+
+class _CachedFieldMethods(object):
+    # methods for CachedXmlObject, which is created by calling the
+    # metaclass directly
+
+    def _field_memo(self):
+        # memoized field values for the current state of the document
+        root = self.node.getroottree().getroot()
+        state = _document_state(root)
+        memo = self.__dict__.get('_memo')
+        if memo is None or memo[0] is not root or memo[1] != state:
+            namespaces = self.context.get('namespaces', {})
+            memo = self.__dict__['_memo'] = (root, state, {
+                '__namespaces__': tuple(sorted(namespaces.items())),
+            })
+        return memo[2]
+
+    def invalidate_cache(self):
+        '''Discard remembered field values for this document.  Needed
+        only when the xml has been modified other than through a field
+        on a :class:`CachedXmlObject` (e.g. by working with the lxml
+        nodes directly).'''
+        _invalidate(self.node)
+
+
+CachedXmlObject = _CachedXmlObjectType('CachedXmlObject',
+                                       (_CachedFieldMethods, xmlmap.XmlObject), {
+    '__module__': __name__,
+    '__doc__': ''':class:`~eulxml.xmlmap.XmlObject` subclass that
+    evaluates simple single-valued fields with precompiled xpaths and
+    remembers the values on the instance, so repeated access does not
+    evaluate the xpath again.
+
+    All simple (non-node, non-list) fields use precompiled xpaths.
+    Values are only remembered for fields declared on
+    :class:`CachedXmlObject` subclasses, and only when no node or list
+    field on the class maps to the same child elements (e.g. MODS
+    identifier fields, which can be modified through the eulxml
+    ``identifiers`` list, are evaluated on every access).  Remembered values are discarded whenever the document
+    is modified through a field on any :class:`CachedXmlObject`.  If
+    the xml is modified in some other way (e.g. by working with the
+    lxml nodes directly), call :meth:`invalidate_cache`.''',
+})
@@ -1,8 +1,12 @@
+from lxml import etree
+
 from eulxml import xmlmap
 from eulxml.xmlmap import mods
 
+from eulcm.xmlmap.core import CachedXmlObject
+
 
-class MODS(mods.MODS):
+class MODS(CachedXmlObject, mods.MODS):
     '''Extend base :class:`eulxml.xmlmap.mods.MODS` with short-cut
     fields for identifiers and access conditions with custom types.'''
     
@@ -27,4 +31,42 @@ class MODS(mods.MODS):
                                               mods.AccessCondition)
     ':class:`eulxml.xmlmap.mods.AccessCondition` with type "use and reproduction"'
 
+    def typed_identifiers(self):
+        '''Dictionary of all typed identifiers, gathered in a single
+        pass over the ``mods:identifier`` elements rather than one
+        xpath per identifier field.  Keys are identifier types (e.g.
+        ``ark``, ``uri``, ``local_source_id``), values are lists of
+        identifier text in document order.'''
+        return _typed_identifiers(self.node)
+
+    @classmethod
+    def bulk_typed_identifiers(cls, documents):
+        '''Typed identifiers for a list of MODS documents; see
+        :meth:`typed_identifiers`.
+
+        :param documents: iterable of :class:`MODS` instances, lxml
+            elements, or xml strings
+        :returns: list of dictionaries, in the same order as the documents
+        '''
+        results = []
+        for doc in documents:
+            if isinstance(doc, xmlmap.XmlObject):
+                node = doc.node
+            elif etree.iselement(doc):
+                node = doc
+            else:
+                node = etree.fromstring(doc)
+            results.append(_typed_identifiers(node))
+        return results
+
+
+_IDENTIFIER_TAG = '{%s}identifier' % mods.MODS_NAMESPACE
 
+def _typed_identifiers(node):
+    # single pass over mods:identifier children of a mods node
+    ids = {}
+    for el in node.iterchildren(_IDENTIFIER_TAG):
+        id_type = el.get('type')
+        if id_type is not None:
+            ids.setdefault(id_type, []).append(''.join(el.itertext()))
+    return ids
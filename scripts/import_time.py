@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# file scripts/import_time.py
+#
+#   Copyright 2012 Emory University Libraries
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+Benchmark import time for eulcm modules.  Each import is timed in a
+fresh interpreter, and the median of several runs is reported, along
+with the baseline time for starting an interpreter.
+
+Usage::
+
+  python scripts/import_time.py [-n RUNS] [module ...]
+
+'''
+
+import argparse
+import subprocess
+import sys
+import time
+
+
+DEFAULT_MODULES = [
+    'eulcm.models',
+    'eulcm.models.collection.v1_0',
+    'eulcm.models.collection.v1_1',
+    'eulcm.models.boda',
+    'eulcm.xmlmap.boda',
+    'eulcm.index',
+]
+
+
+def time_import(statement, runs):
+    # median wall-clock time in milliseconds to run a statement in a
+    # new interpreter
+    times = []
+    for i in range(runs):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', statement])
+        times.append((time.time() - start) * 1000)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark eulcm import times')
+    parser.add_argument('-n', '--runs', type=int, default=10,
+                        help='number of runs per module (default: %(default)s)')
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES,
+                        help='modules to import')
+    args = parser.parse_args()
+
+    baseline = time_import('pass', args.runs)
+    print('%-40s %8.1f ms' % ('(interpreter startup)', baseline))
+    for module in args.modules:
+        elapsed = time_import('import %s' % module, args.runs)
+        print('%-40s %8.1f ms  (+%.1f)' % (module, elapsed, elapsed - baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+# file test/fakes.py
+#
+#   Copyright 2012 Emory University Libraries
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+In-memory stand-ins for the parts of the Fedora REST API and Resource
+Index used by eulcm, so that eulcm objects can be tested without a
+running Fedora repository.
+
+'''
+
+from collections import namedtuple
+import datetime
+import hashlib
+import io
+import itertools
+import threading
+
+from eulfedora.util import RequestFailed
+from eulfedora.xml import DatastreamProfile, ObjectProfile, FEDORA_ACCESS_NS
+
+
+class FakeResponse(object):
+    'Minimal :class:`requests.Response` stand-in.'
+
+    def __init__(self, content=b'', status_code=200, url=''):
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        self.content = content
+        self.status_code = status_code
+        self.url = url
+        self.raw = io.BytesIO(content)
+        self.closed = False
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+def request_failed(status_code, message='error'):
+    ':class:`~eulfedora.util.RequestFailed` for an http status code.'
+    return RequestFailed(FakeResponse(message, status_code))
+
+
+StoredDatastream = namedtuple('StoredDatastream', ['content', 'checksum',
+                                                   'created', 'mimetype'])
+
+
+class FakeAPI(object):
+    '''Stand-in for :class:`eulfedora.api.REST_API`, with objects and
+    datastreams stored in memory.  All calls are recorded in
+    :attr:`calls` as (method name, pid, dsid) tuples.'''
+
+    base_url = 'http://fedora.example.com/fedora/'
+    username = None
+    password = None
+
+    def __init__(self, base_url=None):
+        if base_url is not None:
+            self.base_url = base_url
+        self.objects = {}
+        self.uploads = {}
+        self.calls = []
+        self._lock = threading.Lock()
+        self._pids = itertools.count(1)
+        self._dates = itertools.count(1)
+
+    def add_datastream(self, pid, dsid, content, mimetype='text/xml', checksum=None):
+        'Add or replace a datastream; checksum defaults to the MD5 of the content.'
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        if checksum is None:
+            checksum = hashlib.md5(content).hexdigest()
+        created = datetime.datetime(2012, 1, 1, tzinfo=datetime.timezone.utc) + \
+                  datetime.timedelta(seconds=next(self._dates))
+        self.objects.setdefault(pid, {})[dsid] = StoredDatastream(
+            content, checksum, created, mimetype)
+
+    def add_object(self, pid):
+        self.objects.setdefault(pid, {})
+
+    def count(self, method):
+        'Number of calls made to an api method.'
+        return len([call for call in self.calls if call[0] == method])
+
+    def _call(self, method, pid=None, dsid=None):
+        with self._lock:
+            self.calls.append((method, pid, dsid))
+
+    def _datastream(self, pid, dsid):
+        try:
+            return self.objects[pid][dsid]
+        except KeyError:
+            raise request_failed(404, 'Not Found')
+
+    def getObjectProfile(self, pid):
+        self._call('getObjectProfile', pid)
+        if pid not in self.objects:
+            raise request_failed(404, 'Not Found')
+        profile = ObjectProfile()
+        profile.label = pid
+        profile.state = 'A'
+        return FakeResponse(profile.serialize())
+
+    def listDatastreams(self, pid):
+        self._call('listDatastreams', pid)
+        datastreams = ''.join(
+            '<datastream dsid="%s" label="%s" mimeType="%s"/>' % (dsid, dsid, ds.mimetype)
+            for dsid, ds in sorted(self.objects.get(pid, {}).items()))
+        return FakeResponse('<objectDatastreams xmlns="%s" pid="%s">%s</objectDatastreams>'
+                            % (FEDORA_ACCESS_NS, pid, datastreams))
+
+    def getDatastream(self, pid, dsid, asOfDateTime=None, **kwargs):
+        self._call('getDatastream', pid, dsid)
+        ds = self._datastream(pid, dsid)
+        profile = DatastreamProfile()
+        profile.label = dsid
+        profile.mimetype = ds.mimetype
+        profile.state = 'A'
+        profile.control_group = 'M'
+        profile.created = ds.created
+        profile.size = len(ds.content)
+        profile.checksum = ds.checksum
+        profile.checksum_type = 'MD5' if ds.checksum != 'none' else 'DISABLED'
+        return FakeResponse(profile.serialize())
+
+    def getDatastreamDissemination(self, pid, dsID, asOfDateTime=None,
+                                   stream=False, **kwargs):
+        self._call('getDatastreamDissemination', pid, dsID)
+        return FakeResponse(self._datastream(pid, dsID).content)
+
+    def getNextPID(self, numPIDs=None, namespace=None):
+        self._call('getNextPID')
+        return FakeResponse('<pidList><pid>%s:%d</pid></pidList>'
+                            % (namespace or 'test', next(self._pids)))
+
+    def upload(self, data, callback=None, content_type=None):
+        self._call('upload')
+        content = data.read()
+        with self._lock:
+            upload_id = 'uploaded://%d' % (len(self.uploads) + 1)
+            self.uploads[upload_id] = content
+        return upload_id
+
+
+class FakeResourceIndex(object):
+    '''Stand-in for :class:`eulfedora.api.ResourceIndex`; queries
+    return canned results, and are recorded in :attr:`queries`.'''
+
+    def __init__(self, sparql_results=None, subjects=None,
+                 base_url=FakeAPI.base_url):
+        self.base_url = base_url
+        self.sparql_results = sparql_results or []
+        self.subjects = subjects or []
+        self.queries = []
+
+    def sparql_query(self, query, **kwargs):
+        self.queries.append(query)
+        return list(self.sparql_results)
+
+    def get_subjects(self, predicate, object):
+        self.queries.append((predicate, object))
+        return list(self.subjects)
+
+
+class FakeRepository(object):
+    'Stand-in for :class:`eulfedora.server.Repository`.'
+
+    def __init__(self, api=None):
+        self.api = api or FakeAPI()
+
+    def get_object(self, pid=None, type=None, create=None):
+        from eulfedora.models import DigitalObject
+        if type is None:
+            type = DigitalObject
+        if pid is None:
+            return type(self.api)
+        return type(self.api, pid)
@@ -0,0 +1,187 @@
+import datetime
+import gc
+import os
+import stat
+import time
+
+import pytest
+
+from eulcm.cache import AccessCache, DatastreamCache, IdentityMap, LRUCache, \
+     current_identity_map
+from eulcm.models.boda import Arrangement, Mailbox
+from eulcm.xmlmap.boda import Rights
+
+from fakes import FakeAPI
+from test_xmlmap_boda import rights_xml
+
+
+def test_lru_cache_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    # b was least recently used
+    assert cache.keys() == ['a', 'c']
+    assert cache.pop('a') == 1
+    assert len(cache) == 1
+
+
+def test_lru_cache_contains_does_not_promote():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert 'a' in cache
+    assert 'z' not in cache
+    cache.set('c', 3)
+    assert cache.keys() == ['b', 'c']
+
+
+def test_lru_cache_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    cache = LRUCache(ttl=10)
+    cache.set('a', 1)
+    now[0] += 5
+    assert 'a' in cache
+    assert cache.get('a') == 1
+    now[0] += 10
+    assert 'a' not in cache
+    assert cache.get('a') is None
+    assert cache.get_stale('a') == 1
+
+
+def test_access_cache_reuses_decisions():
+    api = FakeAPI()
+    api.add_datastream('test:1', 'Rights', rights_xml('2'))
+    cache = AccessCache(['2'])
+    decision = cache.decision(Arrangement(api, 'test:1'))
+    assert decision.allowed
+    requests = len(api.calls)
+    assert cache.decision(Arrangement(api, 'test:1')) == decision
+    assert len(api.calls) == requests
+
+
+def test_access_cache_checks_version_after_ttl():
+    api = FakeAPI()
+    api.add_datastream('test:1', 'Rights', rights_xml('2'))
+    cache = AccessCache(['2'], ttl=0)
+    cache.decision(Arrangement(api, 'test:1'))
+    # expired, but unchanged: only the profile is checked
+    assert cache.decision(Arrangement(api, 'test:1')).allowed
+    assert api.count('getDatastream') == 2
+    assert api.count('getDatastreamDissemination') == 1
+
+    api.add_datastream('test:1', 'Rights', rights_xml('8'))
+    assert not cache.decision(Arrangement(api, 'test:1')).allowed
+    assert api.count('getDatastreamDissemination') == 2
+
+
+def test_access_cache_partial_expiration():
+    api = FakeAPI()
+    next_year = str(datetime.date.today().year + 1)
+    api.add_datastream('test:1', 'Rights', rights_xml('4', next_year))
+    decision = AccessCache(['2']).decision(Arrangement(api, 'test:1'))
+    assert decision.expiration == datetime.date(int(next_year), 12, 31)
+    assert not decision.expired
+
+
+def test_access_cache_expiration_boundary():
+    api = FakeAPI()
+    today = datetime.date.today()
+    api.add_datastream('test:1', 'Rights', rights_xml('4', today.isoformat()))
+    api.add_datastream('test:2', 'Rights', rights_xml(
+        '4', (today - datetime.timedelta(days=1)).isoformat()))
+    cache = AccessCache(['2'], ttl=0)
+    for i in range(2):
+        # checked when loaded, and again for unchanged cached rights
+        assert not cache.decision(Arrangement(api, 'test:1')).expired
+        assert cache.decision(Arrangement(api, 'test:2')).expired
+    assert api.count('getDatastreamDissemination') == 2
+
+
+def test_access_cache_no_rights():
+    api = FakeAPI()
+    api.add_object('test:1')
+    decision = AccessCache(['2']).decision(Arrangement(api, 'test:1'))
+    assert decision.code is None
+    assert not decision.allowed
+
+
+def test_identity_map_shares_instances():
+    obj = Arrangement(FakeAPI(), 'test:1')
+    with IdentityMap() as identity_map:
+        assert current_identity_map() is identity_map
+        mailbox = obj.get_object('info:fedora/test:mbox', Mailbox)
+        assert obj.get_object('test:mbox', Mailbox) is mailbox
+        # instances are per type
+        assert obj.get_object('test:mbox', Arrangement) is not mailbox
+    assert current_identity_map() is None
+    assert obj.get_object('test:mbox', Mailbox) is not mailbox
+
+
+def test_identity_map_keeps_referenced_objects():
+    obj = Arrangement(FakeAPI(), 'test:1')
+    identity_map = IdentityMap(maxsize=2)
+    # e.g. a list of objects loaded in bulk, still in use
+    loaded = [identity_map.get_object(obj, 'test:%d' % i) for i in range(10)]
+    # objects evicted from the lru cache are not replaced while in use
+    assert identity_map.get_object(obj, 'test:0') is loaded[0]
+    assert len(identity_map) == 10
+
+    recent = loaded[-1]
+    del loaded
+    gc.collect()
+    # only the most recently used objects are held by the map
+    assert len(identity_map) == 2
+    assert identity_map.get_object(obj, 'test:9') is recent
+
+
+def test_identity_map_invalidate():
+    obj = Arrangement(FakeAPI(), 'test:1')
+    identity_map = IdentityMap(maxsize=1)
+    first = identity_map.get_object(obj, 'test:a')
+    other = identity_map.get_object(obj, 'test:b')
+    identity_map.invalidate('info:fedora/test:a')
+    assert identity_map.get_object(obj, 'test:a') is not first
+    identity_map.add(other)
+    assert identity_map.get_object(obj, 'test:b') is other
+    identity_map.clear()
+    assert identity_map.get_object(obj, 'test:b') is not other
+
+
+def test_datastream_cache_creates_private_directory(tmpdir):
+    directory = str(tmpdir.join('cache', 'datastreams'))
+    DatastreamCache(directory)
+    assert stat.S_IMODE(os.stat(directory).st_mode) & 0o077 == 0
+
+
+def test_datastream_cache_rejects_shared_directory(tmpdir):
+    directory = str(tmpdir.mkdir('shared'))
+    os.chmod(directory, 0o777)
+    with pytest.raises(ValueError):
+        DatastreamCache(directory)
+    os.chmod(directory, 0o755)
+    DatastreamCache(directory)
+
+
+def test_datastream_cache_rejects_other_owner(tmpdir, monkeypatch):
+    directory = str(tmpdir.mkdir('other'))
+    monkeypatch.setattr(os, 'getuid', lambda: os.stat(directory).st_uid + 1)
+    with pytest.raises(ValueError):
+        DatastreamCache(directory)
+
+
+def access_code(xml):
+    return xml.access_status.code
+
+
+def test_datastream_cache_get_value(tmpdir):
+    api = FakeAPI()
+    api.add_datastream('test:1', 'Rights', rights_xml('2'))
+    obj = Arrangement(api, 'test:1')
+    cache = DatastreamCache(str(tmpdir.join('cache')))
+    assert cache.get_value(obj, 'Rights', Rights, access_code) == '2'
+    requests = api.count('getDatastreamDissemination')
+    assert cache.get_value(Arrangement(api, 'test:1'), 'Rights', Rights, access_code) == '2'
+    assert api.count('getDatastreamDissemination') == requests
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from eulcm.fetch import datastream_version, fetch_datastreams, fetch_profiles, \
+     iter_concurrently, run_concurrently, uri_to_pid
+
+from fakes import FakeAPI
+
+
+def test_run_concurrently_keeps_order():
+    def slow_square(n):
+        time.sleep(0.01 * (5 - n))
+        return n * n
+
+    assert run_concurrently(slow_square, range(5), workers=5) == [0, 1, 4, 9, 16]
+    assert run_concurrently(slow_square, [], workers=5) == []
+
+
+def test_iter_concurrently():
+    results = list(iter_concurrently(lambda n: n * 2, range(20), workers=3))
+    assert sorted(results) == [n * 2 for n in range(20)]
+
+
+def test_iter_concurrently_bounded_input():
+    taken = []
+    running = []
+    peak = [0]
+    lock = threading.Lock()
+
+    def items():
+        for i in range(100):
+            taken.append(i)
+            yield i
+
+    def work(n):
+        with lock:
+            running.append(n)
+            peak[0] = max(peak[0], len(running))
+        time.sleep(0.001)
+        with lock:
+            running.remove(n)
+        return n
+
+    results = iter_concurrently(work, items(), workers=4)
+    for _ in range(3):
+        next(results)
+    # items are taken only as workers become free, not read ahead
+    # while the caller is handling results
+    count = len(taken)
+    assert count <= 3 + 2 * 4
+    time.sleep(0.05)
+    assert len(taken) == count
+    results.close()
+    assert len(taken) < 100
+    assert peak[0] <= 4
+
+
+def test_iter_concurrently_error():
+    def fail(n):
+        if n == 3:
+            raise ValueError('bad item')
+        return n
+
+    with pytest.raises(ValueError):
+        list(iter_concurrently(fail, range(10), workers=2))
+
+
+def test_uri_to_pid():
+    assert uri_to_pid('info:fedora/test:1') == 'test:1'
+    assert uri_to_pid('test:1') == 'test:1'
+
+
+def test_fetch_datastreams():
+    api = FakeAPI()
+    api.add_datastream('test:1', 'MODS', '<mods/>')
+    api.add_datastream('test:1', 'Rights', '<rights/>')
+    api.add_datastream('test:2', 'MODS', '<mods/>')
+
+    content = fetch_datastreams(api, ['test:1', 'test:2'], ['MODS', 'Rights'], workers=2)
+    assert content == {('test:1', 'MODS'): b'<mods/>', ('test:1', 'Rights'): b'<rights/>',
+                       ('test:2', 'MODS'): b'<mods/>', ('test:2', 'Rights'): None}
+    assert api.count('getDatastreamDissemination') == 4
+
+
+def test_fetch_profiles():
+    api = FakeAPI()
+    api.add_datastream('test:1', 'Rights', '<rights/>')
+    api.add_datastream('test:2', 'Rights', '<rights/>', checksum='none')
+
+    profiles = fetch_profiles(api, ['test:1', 'test:2', 'test:3'], 'Rights')
+    assert datastream_version(profiles['test:1']) == \
+        api.objects['test:1']['Rights'].checksum
+    # creation date is used when checksums are disabled
+    assert datastream_version(profiles['test:2']) == \
+        str(api.objects['test:2']['Rights'].created)
+    assert profiles['test:3'] is None
+    # content is not retrieved
+    assert api.count('getDatastreamDissemination') == 0
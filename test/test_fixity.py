@@ -0,0 +1,83 @@
+import hashlib
+
+from eulcm.fixity import ERROR, MISMATCH, NO_CHECKSUM, NO_CONTENT, OK, \
+     FixityReport, FixityResult, check_fixity, verify_fixity
+from eulcm.models.boda import EmailMessage, RushdieFile
+
+from fakes import FakeAPI
+from test_xmlmap_boda import filetech_xml
+
+
+CONTENT = b'file content ' * 100
+
+
+def add_file(api, pid, content=CONTENT, md5=None):
+    'Add a RushdieFile-like object with ORIGINAL and FileMasterTech datastreams.'
+    if md5 is None:
+        md5 = hashlib.md5(content).hexdigest()
+    api.add_datastream(pid, 'FileMasterTech', filetech_xml(
+        [{'localId': '1', 'md5': md5.upper(), 'path': '/file'}]))
+    if content is not None:
+        api.add_datastream(pid, 'ORIGINAL', content, mimetype='application/octet-stream')
+
+
+def test_check_fixity():
+    api = FakeAPI()
+    add_file(api, 'test:ok')
+    add_file(api, 'test:changed', md5='0' * 32)
+    add_file(api, 'test:nocontent', content=None, md5='1' * 32)
+    api.add_datastream('test:nomd5', 'ORIGINAL', CONTENT)
+
+    result = check_fixity(api, 'test:ok', chunk_size=64)
+    md5 = hashlib.md5(CONTENT).hexdigest()
+    # manifest checksums are compared case-insensitively
+    assert result == FixityResult('test:ok', OK, md5, md5, None)
+    result = check_fixity(api, 'test:changed')
+    assert result.status == MISMATCH
+    assert (result.expected, result.actual) == ('0' * 32, md5)
+    assert check_fixity(api, 'test:nocontent').status == NO_CONTENT
+    assert check_fixity(api, 'test:nomd5').status == NO_CHECKSUM
+
+
+def test_check_fixity_error():
+    class FailingAPI(FakeAPI):
+        def getDatastreamDissemination(self, pid, dsID, **kwargs):
+            raise IOError('connection reset')
+
+    result = check_fixity(FailingAPI(), 'test:1')
+    assert result.status == ERROR
+    assert result.error == 'OSError: connection reset'
+
+
+def test_rushdie_file_verify_fixity():
+    api = FakeAPI()
+    add_file(api, 'test:1')
+    assert RushdieFile(api, 'test:1').verify_fixity().status == OK
+    # fixity only applies to files, which have ORIGINAL content
+    assert not hasattr(EmailMessage, 'verify_fixity')
+
+
+def test_verify_fixity_resumes_from_report(tmpdir):
+    api = FakeAPI()
+    for pid in ('test:1', 'test:2', 'test:3'):
+        add_file(api, pid)
+    add_file(api, 'test:4', md5='0' * 32)
+    filename = str(tmpdir.join('fixity.csv'))
+
+    report = FixityReport(filename)
+    report.record(FixityResult('test:1', OK, 'a', 'a', None))
+    report.record(FixityResult('test:2', ERROR, None, None, 'IOError: timed out'))
+    report.close()
+
+    report = FixityReport(filename)
+    assert report.checked == set(['test:1'])
+    results = list(verify_fixity(api, ['test:1', 'info:fedora/test:2', 'test:3', 'test:4'],
+                                 report=report, workers=2))
+    report.close()
+    # objects with errors are checked again
+    assert sorted(r.pid for r in results) == ['test:2', 'test:3', 'test:4']
+
+    report = FixityReport(filename)
+    assert report.checked == set(['test:1', 'test:2', 'test:3', 'test:4'])
+    # the most recent result is used for each object
+    assert [(r.pid, r.status) for r in report.problems()] == [('test:4', MISMATCH)]
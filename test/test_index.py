@@ -0,0 +1,326 @@
+import datetime
+import threading
+
+from eulxml.xmlmap import load_xmlobject_from_string
+
+from eulcm.index import ArkIndex, ExpirationIndex, FileLocation, Md5Index, \
+     SeriesIndex, normalize_ark
+from eulcm.models.boda import Arrangement
+from eulcm.xmlmap.boda import ArrangementMods, FileRecord, Rights, SeriesKey
+from eulcm.xmlmap.mods import MODS
+
+from fakes import FakeAPI
+from test_xmlmap_boda import FILES, filetech_xml, rights_xml
+
+
+def record(md5, path, computer='PowerBook'):
+    return FileRecord(None, md5, computer, path, *[None] * 6)
+
+
+def test_md5_index_find():
+    index = Md5Index()
+    index.add('test:1', [record('aaa', '/a'), record('bbb', '/b'), record(None, '/c')])
+    index.add('test:2', [record('aaa', '/copy of a')])
+    assert sorted(index.find('aaa')) == [FileLocation('test:1', '/a', 'PowerBook'),
+                                         FileLocation('test:2', '/copy of a', 'PowerBook')]
+    assert index.find('ccc') == []
+    found = index.find_many(['aaa', 'bbb', 'ccc', 'bbb'])
+    assert sorted(found) == ['aaa', 'bbb']
+    assert found['bbb'] == [FileLocation('test:1', '/b', 'PowerBook')]
+
+
+def test_md5_index_duplicates():
+    index = Md5Index()
+    index.add('test:1', [record('aaa', '/a'), record('bbb', '/b')])
+    index.add('test:2', [record('aaa', '/copy of a')])
+    assert [(md5, len(locations)) for md5, locations in index.duplicates()] == \
+        [('aaa', 2)]
+
+
+def test_md5_index_replace_and_remove():
+    index = Md5Index()
+    index.add('test:1', [record('aaa', '/a')], version='v1')
+    index.add('test:1', [record('bbb', '/b')], version='v2')
+    assert index.find('aaa') == []
+    assert index.indexed_version('test:1') == 'v2'
+    index.remove('test:1')
+    assert index.find('bbb') == []
+    assert index.indexed_version('test:1') is None
+
+
+def test_md5_index_persistent(tmpdir):
+    filename = str(tmpdir.join('md5.db'))
+    index = Md5Index(filename)
+    index.add('test:1', [record('aaa', '/a')], version='v1')
+    index.close()
+    index = Md5Index(filename)
+    assert index.find('aaa') == [FileLocation('test:1', '/a', 'PowerBook')]
+    assert not index.needs_update('test:1', 'v1')
+
+
+def test_md5_index_add_object_skips_unchanged():
+    api = FakeAPI()
+    api.add_datastream('test:1', 'FileMasterTech', filetech_xml(FILES))
+    index = Md5Index()
+    assert index.add_object(Arrangement(api, 'test:1'))
+    assert [loc.path for loc in index.find('ccc')] == ['/Drafts/novel.doc']
+    requests = api.count('getDatastreamDissemination')
+    assert not index.add_object(Arrangement(api, 'test:1'))
+    assert api.count('getDatastreamDissemination') == requests
+
+    # changed content is reindexed
+    api.add_datastream('test:1', 'FileMasterTech', filetech_xml(FILES[:1]))
+    assert index.update([Arrangement(api, 'test:1')]) == 1
+    assert index.find('ccc') == []
+
+
+def rights(expiration=None):
+    return load_xmlobject_from_string(rights_xml('4', expiration), Rights)
+
+
+def test_expiration_index():
+    index = ExpirationIndex()
+    index.add('test:1', rights('2020-03-15'))
+    index.add('test:2', rights('2020'))
+    index.add('test:3', rights('2020-06'))
+    index.add('test:4', rights())
+    # partial dates are indexed as the end of the year or month
+    assert index.upcoming() == [('test:1', datetime.date(2020, 3, 15)),
+                                ('test:3', datetime.date(2020, 6, 30)),
+                                ('test:2', datetime.date(2020, 12, 31))]
+    assert index.upcoming(until=datetime.date(2020, 6, 1)) == \
+        [('test:1', datetime.date(2020, 3, 15))]
+    # restrictions expire after their expiration date
+    assert index.upcoming(until=datetime.date(2020, 3, 15)) == []
+    assert index.upcoming(until=datetime.date(2020, 3, 16)) == \
+        [('test:1', datetime.date(2020, 3, 15))]
+    assert index.upcoming(limit=1) == [('test:1', datetime.date(2020, 3, 15))]
+
+
+def test_expiration_index_pop_expired():
+    index = ExpirationIndex()
+    index.add('test:1', rights('2020-03-15'))
+    index.add('test:2', rights('2020-06'))
+    assert index.pop_expired(today=datetime.date(2020, 6, 15)) == \
+        [('test:1', datetime.date(2020, 3, 15))]
+    # popped restrictions are not returned again
+    assert index.pop_expired(today=datetime.date(2020, 6, 15)) == []
+    assert index.pop_expired(today=datetime.date(2020, 7, 1)) == \
+        [('test:2', datetime.date(2020, 6, 30))]
+
+
+def test_expiration_index_pop_expired_boundary():
+    index = ExpirationIndex()
+    index.add('test:1', rights('2020'))
+    index.add('test:2', rights('2020-12-30'))
+    # still restricted on the last day of the year
+    assert index.pop_expired(today=datetime.date(2020, 12, 31)) == \
+        [('test:2', datetime.date(2020, 12, 30))]
+    assert index.pop_expired(today=datetime.date(2021, 1, 1)) == \
+        [('test:1', datetime.date(2020, 12, 31))]
+
+
+def test_expiration_index_pop_expired_since():
+    index = ExpirationIndex()
+    index.add('test:1', rights('2020-06-09'))
+    index.add('test:2', rights('2020-06-10'))
+    index.add('test:3', rights('2020-06-14'))
+    # test:1 expired on 2020-06-10, e.g. already handled by a run that day
+    assert index.pop_expired(since=datetime.date(2020, 6, 10),
+                             today=datetime.date(2020, 6, 15)) == \
+        [('test:2', datetime.date(2020, 6, 10)), ('test:3', datetime.date(2020, 6, 14))]
+
+
+def test_expiration_index_removes_lifted_restrictions():
+    index = ExpirationIndex()
+    index.add('test:1', rights('2020'), version='v1')
+    index.add('test:1', rights(), version='v2')
+    assert index.upcoming() == []
+    assert index.indexed_version('test:1') == 'v2'
+
+
+def test_expiration_index_add_object():
+    api = FakeAPI()
+    api.add_datastream('test:1', 'Rights', rights_xml('4', '2030'))
+    index = ExpirationIndex()
+    assert index.add_object(Arrangement(api, 'test:1'))
+    assert not index.add_object(Arrangement(api, 'test:1'))
+    assert index.upcoming() == [('test:1', datetime.date(2030, 12, 31))]
+
+
+def mods_with_ark(ark=None, uri=None):
+    mods = MODS()
+    if ark:
+        mods.ark = ark
+    if uri:
+        mods.ark_uri = uri
+    return mods
+
+
+def test_normalize_ark():
+    assert normalize_ark('ark:/25593/abc') == 'ark:/25593/abc'
+    assert normalize_ark('http://pid.emory.edu/ark:/25593/abc ') == 'ark:/25593/abc'
+    assert normalize_ark('http://example.com/') is None
+    assert normalize_ark(None) is None
+
+
+def test_ark_index_lookup():
+    index = ArkIndex()
+    index.add('test:1', mods_with_ark('ark:/25593/abc'))
+    index.add('test:2', mods_with_ark(uri='http://pid.emory.edu/ark:/25593/def'))
+    assert index.lookup('ark:/25593/abc') == 'test:1'
+    assert index.lookup('http://pid.emory.edu/ark:/25593/abc') == 'test:1'
+    assert index.lookup('ark:/25593/def') == 'test:2'
+    assert index.lookup('ark:/25593/missing') is None
+
+
+def test_ark_index_replace_and_remove():
+    index = ArkIndex()
+    index.add('test:1', mods_with_ark('ark:/25593/abc'))
+    assert index.lookup('ark:/25593/abc') == 'test:1'
+    index.add('test:1', mods_with_ark('ark:/25593/new'))
+    assert index.lookup('ark:/25593/abc') is None
+    assert index.lookup('ark:/25593/new') == 'test:1'
+    index.remove('test:1')
+    assert index.lookup('ark:/25593/new') is None
+
+
+def test_ark_index_persistent(tmpdir):
+    filename = str(tmpdir.join('arks.db'))
+    index = ArkIndex(filename)
+    index.add('test:1', mods_with_ark('ark:/25593/abc'), version='v1')
+    # a second index on the same file sees updates after reloading
+    other = ArkIndex(filename)
+    assert other.lookup('ark:/25593/abc') == 'test:1'
+    index.add('test:2', mods_with_ark('ark:/25593/def'))
+    assert other.lookup('ark:/25593/def') is None
+    other.reload()
+    assert other.lookup('ark:/25593/def') == 'test:2'
+
+
+def test_ark_index_other_threads(tmpdir):
+    index = ArkIndex(str(tmpdir.join('arks.db')))
+    index.add('test:1', mods_with_ark('ark:/25593/abc'))
+    results = []
+
+    def resolve():
+        # e.g. a resolver request thread
+        results.append(index.lookup('ark:/25593/abc'))
+        index.add('test:2', mods_with_ark('ark:/25593/def'))
+        index.reload()
+        results.append(index.lookup('ark:/25593/def'))
+
+    thread = threading.Thread(target=resolve)
+    thread.start()
+    thread.join()
+    assert results == ['test:1', 'test:2']
+
+
+def test_ark_index_add_object():
+    api = FakeAPI()
+    api.add_datastream('test:1', 'MODS', mods_with_ark('ark:/25593/abc').serialize())
+    index = ArkIndex()
+    assert index.add_object(Arrangement(api, 'test:1'))
+    assert not index.add_object(Arrangement(api, 'test:1'))
+    assert index.lookup('ark:/25593/abc') == 'test:1'
+
+
+def series_xml(full_id, short_id, title, inner=''):
+    return ('<mods:relatedItem type="series"><mods:titleInfo><mods:title>%s</mods:title>'
+            '</mods:titleInfo><mods:identifier type="full_id">%s</mods:identifier>'
+            '<mods:identifier type="short_id">%s</mods:identifier>%s</mods:relatedItem>'
+            % (title, full_id, short_id, inner))
+
+
+def arrangement_mods(series=None, subseries=None):
+    'ArrangementMods xml for a series and optional subseries (full id, short id, title).'
+    related = ''
+    if subseries:
+        related = series_xml(*subseries, inner=series_xml(*series))
+    elif series:
+        related = series_xml(*series)
+    return ('<mods:mods xmlns:mods="http://www.loc.gov/mods/v3">%s</mods:mods>'
+            % related).encode('utf-8')
+
+
+SERIES1 = ('series1', 'S1', 'Correspondence')
+SERIES2 = ('series2', 'S2', 'Writings')
+# subseries with the same short id as a series
+SUB1 = ('series1:sub1', 'S2', 'Letters')
+
+
+def key(ids):
+    return SeriesKey(ids[0], ids[1], ids[2], None, None)
+
+
+def series_index():
+    index = SeriesIndex()
+    for pid, series, subseries in [('test:1', SERIES1, None),
+                                   ('test:2', SERIES1, SUB1),
+                                   ('test:3', SERIES2, None),
+                                   ('test:4', None, None)]:
+        mods = load_xmlobject_from_string(arrangement_mods(series, subseries),
+                                          ArrangementMods)
+        index.add(pid, mods)
+    return index
+
+
+def test_series_index_members():
+    index = series_index()
+    assert index.members(key(SERIES1)) == ['test:1', 'test:2']
+    assert index.members(key(SERIES1), include_subseries=False) == ['test:1']
+    assert index.members(key(SERIES1), key(SUB1)) == ['test:2']
+    # members are found by full series key, not an ambiguous short id
+    assert index.members(key(SERIES2)) == ['test:3']
+
+
+def test_series_index_find():
+    index = series_index()
+    assert index.find('series1') == [(key(SERIES1), None)]
+    assert index.find('S2') == [(key(SERIES1), key(SUB1)), (key(SERIES2), None)]
+    assert index.find('missing') == []
+
+
+def test_series_index_find_uses_indexes():
+    index = series_index()
+    queries = []
+    index.db.set_trace_callback(queries.append)
+    index.find('S2')
+    index.db.set_trace_callback(None)
+    assert queries
+    for query in queries:
+        plan = ' '.join(row[-1] for row in index.db.execute('EXPLAIN QUERY PLAN ' + query))
+        # ids are looked up in indexed columns, not with a table scan
+        assert 'USING INDEX' in plan
+        assert 'SCAN series_members' not in plan
+
+
+def test_series_index_info():
+    index = series_index()
+    assert index.series_info('test:2') == (key(SERIES1), key(SUB1))
+    assert index.series_info('test:1') == (key(SERIES1), None)
+    assert index.series_info('test:4') == (None, None)
+    assert index.subseries(key(SERIES1)) == [key(SUB1)]
+    assert index.subseries(key(SERIES2)) == []
+    index.remove('test:2')
+    assert index.subseries(key(SERIES1)) == []
+
+
+def test_series_index_build():
+    api = FakeAPI()
+    api.add_datastream('test:1', 'MODS', arrangement_mods(SERIES1))
+    api.add_datastream('test:2', 'MODS', arrangement_mods(SERIES1, SUB1))
+    index = SeriesIndex()
+    assert index.build(api, ['test:1', 'test:2']) == 2
+    assert index.members(key(SERIES1)) == ['test:1', 'test:2']
+    assert index.indexed_version('test:1') == api.objects['test:1']['MODS'].checksum
+
+    # unchanged objects are skipped without retrieving content
+    requests = api.count('getDatastreamDissemination')
+    assert index.build(api, ['test:1', 'test:2']) == 0
+    assert api.count('getDatastreamDissemination') == requests
+    assert not index.add_object(Arrangement(api, 'test:1'))
+
+    api.add_datastream('test:2', 'MODS', arrangement_mods(SERIES2))
+    assert index.build(api, ['test:1', 'test:2']) == 1
+    assert index.members(key(SERIES2)) == ['test:2']
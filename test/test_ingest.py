@@ -0,0 +1,158 @@
+import hashlib
+from io import BytesIO
+import os
+
+from requests.exceptions import Timeout
+
+from eulcm.ingest import CHECKSUM_MISMATCH, ERROR, INGESTED, MISSING, \
+     IngestCheckpoint, IngestResult, ingest_file, ingest_files
+from eulcm.models.boda import RushdieFile
+from eulcm.xmlmap.boda import FileMasterTech
+
+from fakes import FakeRepository, request_failed
+from test_xmlmap_boda import filetech_xml
+
+
+CONTENT = b'chapter one\n'
+
+
+def write_file(root, path, content=CONTENT):
+    local_path = os.path.join(str(root), path.lstrip('/'))
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    with open(local_path, 'wb') as f:
+        f.write(content)
+
+
+def manifest_file(path, md5=None):
+    'FileMasterTech_Base for a single file, as parsed from a manifest.'
+    entry = {'localId': '1', 'path': path}
+    if md5 is not None:
+        entry['md5'] = md5
+    return next(FileMasterTech.iterfiles(BytesIO(filetech_xml([entry]))))
+
+
+class SaveRecorder(object):
+    # replacement for RushdieFile.save; eulfedora RELS-EXT serialization
+    # is not needed to test ingest
+    def __init__(self, repo, failures=()):
+        self.repo = repo
+        self.failures = list(failures)
+        self.saved = []
+
+    def patch(self, monkeypatch):
+        monkeypatch.setattr(RushdieFile, 'save',
+                            lambda obj, logMessage=None: self.save(obj, logMessage))
+        return self
+
+    def save(self, obj, logMessage=None):
+        failure = self.failures.pop(0) if self.failures else None
+        if failure == 'lost response':
+            # ingest completes, but the response does not arrive
+            self.ingest(obj)
+            raise Timeout('read timed out')
+        if failure is not None:
+            raise failure
+        self.ingest(obj)
+        return True
+
+    def ingest(self, obj):
+        if callable(obj.pid):
+            # new objects get a pid on ingest, as in DigitalObject.save
+            obj.pid = obj.pid()
+        self.saved.append(obj.pid)
+        self.repo.api.add_object(obj.pid)
+
+
+def test_ingest_file(tmpdir, monkeypatch):
+    repo = FakeRepository()
+    save = SaveRecorder(repo).patch(monkeypatch)
+    write_file(tmpdir, '/disk/chapter.txt')
+    md5 = hashlib.md5(CONTENT).hexdigest()
+
+    result = ingest_file(repo, str(tmpdir), manifest_file('/disk/chapter.txt', md5.upper()))
+    assert result == IngestResult('/disk/chapter.txt', save.saved[0], md5, INGESTED, None)
+    assert list(repo.api.uploads.values()) == [CONTENT]
+
+
+def test_ingest_file_missing_and_mismatch(tmpdir, monkeypatch):
+    repo = FakeRepository()
+    SaveRecorder(repo).patch(monkeypatch)
+    write_file(tmpdir, '/disk/chapter.txt')
+    missing = manifest_file('/disk/other.txt')
+    assert ingest_file(repo, str(tmpdir), missing).status == MISSING
+    changed = manifest_file('/disk/chapter.txt', '0' * 32)
+    result = ingest_file(repo, str(tmpdir), changed)
+    assert result.status == CHECKSUM_MISMATCH
+    assert result.pid is None
+
+
+def test_ingest_file_retries(tmpdir, monkeypatch):
+    repo = FakeRepository()
+    save = SaveRecorder(repo, [request_failed(503), Timeout('read timed out')]).patch(monkeypatch)
+    write_file(tmpdir, '/disk/chapter.txt')
+    filetech = manifest_file('/disk/chapter.txt')
+
+    result = ingest_file(repo, str(tmpdir), filetech, retry_delay=0)
+    assert result.status == INGESTED
+    assert len(save.saved) == 1
+    # existence is checked after each failed save before retrying
+    assert repo.api.count('getObjectProfile') == 2
+
+
+def test_ingest_file_lost_response(tmpdir, monkeypatch):
+    repo = FakeRepository()
+    save = SaveRecorder(repo, ['lost response']).patch(monkeypatch)
+    write_file(tmpdir, '/disk/chapter.txt')
+    filetech = manifest_file('/disk/chapter.txt')
+
+    result = ingest_file(repo, str(tmpdir), filetech, retry_delay=0)
+    # the object was created, so it is not ingested again
+    assert result.status == INGESTED
+    assert result.pid == save.saved[0]
+    assert len(save.saved) == 1
+    assert repo.api.count('upload') == 1
+
+
+def test_ingest_file_not_retryable(tmpdir, monkeypatch):
+    repo = FakeRepository()
+    save = SaveRecorder(repo, [request_failed(400, 'Bad Request')]).patch(monkeypatch)
+    write_file(tmpdir, '/disk/chapter.txt')
+    filetech = manifest_file('/disk/chapter.txt')
+
+    result = ingest_file(repo, str(tmpdir), filetech, retry_delay=0)
+    assert result.status == ERROR
+    assert result.error.startswith('RequestFailed')
+    assert save.saved == []
+
+
+def test_ingest_files_checkpoint(tmpdir, monkeypatch):
+    repo = FakeRepository()
+    save = SaveRecorder(repo).patch(monkeypatch)
+    root = tmpdir.mkdir('image')
+    for name in ('a', 'b', 'c'):
+        write_file(root, '/disk/%s.txt' % name, name.encode('ascii'))
+    manifest = filetech_xml([{'localId': str(i), 'path': '/disk/%s.txt' % name}
+                             for i, name in enumerate(['a', 'b', 'c', 'd'])])
+    filename = str(tmpdir.join('checkpoint.csv'))
+
+    checkpoint = IngestCheckpoint(filename)
+    checkpoint.record(IngestResult('/disk/a.txt', 'test:a', None, INGESTED, None))
+    checkpoint.record(IngestResult('/disk/b.txt', None, None, ERROR, 'Timeout: timed out'))
+    checkpoint.close()
+
+    checkpoint = IngestCheckpoint(filename)
+    assert checkpoint.completed == {'/disk/a.txt': 'test:a'}
+    results = list(ingest_files(repo, str(root), BytesIO(manifest),
+                                checkpoint=checkpoint, workers=2))
+    checkpoint.close()
+    assert sorted((r.path, r.status) for r in results) == [
+        ('/disk/b.txt', INGESTED), ('/disk/c.txt', INGESTED), ('/disk/d.txt', MISSING)]
+    # files completed before the checkpoint are not ingested again
+    assert sorted(save.saved) == sorted(r.pid for r in results if r.status == INGESTED)
+    assert len(save.saved) == 2
+
+    checkpoint = IngestCheckpoint(filename)
+    assert checkpoint.skip == set(['/disk/a.txt', '/disk/b.txt', '/disk/c.txt',
+                                   '/disk/d.txt'])
+    assert sorted(checkpoint.completed) == ['/disk/a.txt', '/disk/b.txt', '/disk/c.txt']
+    assert len(list(checkpoint.results())) == 5
@@ -0,0 +1,36 @@
+import subprocess
+import sys
+
+from eulcm import models
+from eulcm.models import boda
+from eulcm.models.collection import v1_0, v1_1
+
+
+def test_import_does_not_load_models():
+    # model modules (and eulfedora.models) are imported on first use
+    code = ('import sys, eulcm.models; '
+            'print("eulfedora.models" in sys.modules, '
+            '"eulcm.models.boda" in sys.modules)')
+    output = subprocess.check_output([sys.executable, '-c', code])
+    assert output.split() == [b'False', b'False']
+
+
+def test_lazy_attributes():
+    assert models.Collection is v1_1.Collection
+    assert models.Arrangement is boda.Arrangement
+    assert models.RushdieFile is boda.RushdieFile
+    assert 'Mailbox' in dir(models)
+    assert 'CONTENT_MODELS' in dir(models)
+
+
+def test_content_models_from_classes():
+    classes = models.model_classes()
+    assert v1_0.Collection in classes and v1_1.Collection in classes
+    assert len(models.CONTENT_MODELS) == len(models.MODEL_CLASSES)
+    for cls in classes:
+        assert models.CONTENT_MODELS[cls.CONTENT_MODELS[0]] is cls
+        assert models.get_model(cls.CONTENT_MODELS[0]) is cls
+
+
+def test_get_model_unknown():
+    assert models.get_model('info:fedora/example:Unknown-1.0') is None
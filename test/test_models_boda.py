@@ -0,0 +1,284 @@
+from io import BytesIO
+import threading
+
+from eulcm.models.boda import Arrangement, EmailMessage, LazyEmailMessage, \
+     Mailbox, MessageSummary
+
+from fakes import FakeAPI, FakeRepository, FakeResourceIndex
+from test_xmlmap_boda import FILES, filetech_xml
+
+
+def test_filetech_files_streams_from_fedora():
+    api = FakeAPI()
+    api.add_datastream('test:1', 'FileMasterTech', filetech_xml(FILES))
+    obj = Arrangement(api, 'test:1')
+    files = list(obj.filetech_files())
+    assert [f.local_id for f in files] == ['1', '2', '3']
+    # streamed rather than loaded as datastream content
+    assert obj.filetech._content is None
+
+
+def test_filetech_files_uses_local_content():
+    api = FakeAPI()
+    api.add_datastream('test:1', 'FileMasterTech', filetech_xml(FILES))
+    obj = Arrangement(api, 'test:1')
+    obj.filetech.content.file[0].md5 = 'changed'
+    requests = api.count('getDatastreamDissemination')
+    files = list(obj.filetech_files())
+    assert files[0].md5 == 'changed'
+    assert api.count('getDatastreamDissemination') == requests
+
+
+def test_filetech_files_new_object():
+    obj = Arrangement(FakeAPI())
+    assert list(obj.filetech_files()) == []
+
+
+MULTIPART = (
+    'From: author@example.com\n'
+    'Subject: draft\n'
+    'MIME-Version: 1.0\n'
+    'Content-Type: multipart/mixed; boundary="XX"\n'
+    '\n'
+    'preamble\n'
+    '--XX\n'
+    'Content-Type: text/plain\n'
+    '\n'
+    'first part\n'
+    '--XX\n'
+    'Content-Type: text/plain\n'
+    '\n'
+    'second part\n'
+    '--XX--\n')
+
+
+def test_lazy_message_defers_body_parsing():
+    msg = LazyEmailMessage.from_string(MULTIPART)
+    assert msg['Subject'] == 'draft'
+    assert not msg.is_parsed
+    # serializing does not parse the body
+    assert msg.as_string() == MULTIPART
+    assert not msg.is_parsed
+    parts = msg.get_payload()
+    assert msg.is_parsed
+    assert [part.get_payload() for part in parts] == ['first part', 'second part']
+    assert msg.preamble == 'preamble'
+
+
+def test_lazy_message_set_payload():
+    for msg in (LazyEmailMessage.from_string(MULTIPART),
+                LazyEmailMessage.from_bytes(MULTIPART.encode('ascii'))):
+        part = LazyEmailMessage.from_string('Content-Type: text/plain\n\nreplaced\n')
+        msg.set_payload([part])
+        assert msg.is_parsed
+        assert msg.get_payload() == [part]
+        assert b'replaced' in msg.as_bytes()
+        assert 'first part' not in msg.as_string()
+
+    msg = LazyEmailMessage.from_string(MULTIPART)
+    msg.set_payload('plain text')
+    # a string payload is not parsed again
+    assert msg.get_payload() == 'plain text'
+
+
+def test_lazy_message_simple_body():
+    msg = LazyEmailMessage.from_string('Subject: note\n\nbody text\n')
+    assert msg.get_payload() == 'body text\n'
+    assert not msg.is_multipart()
+
+
+def test_message_datastream_content():
+    api = FakeAPI()
+    api.add_datastream('test:1', 'MIME', MULTIPART, mimetype='message/rfc822')
+    obj = EmailMessage(api, 'test:1')
+    msg = obj.mime_data.content
+    assert isinstance(msg, LazyEmailMessage)
+    assert msg['From'] == 'author@example.com'
+    assert not msg.is_parsed
+    assert len(msg.get_payload()) == 2
+
+
+EIGHT_BIT = (b'Subject: caf\xc3\xa9\n'
+             b'Content-Type: text/plain; charset="latin-1"\n'
+             b'Content-Transfer-Encoding: 8bit\n'
+             b'\n'
+             b'na\xefve r\xe9sum\xe9\n')
+
+
+def test_lazy_message_from_bytes_preserves_content():
+    msg = LazyEmailMessage.from_bytes(EIGHT_BIT)
+    assert not msg.is_parsed
+    assert msg.as_bytes() == EIGHT_BIT
+    assert msg.get_payload(decode=True) == b'na\xefve r\xe9sum\xe9\n'
+
+
+def test_lazy_message_from_binary_file():
+    msg = LazyEmailMessage.from_binary_file(BytesIO(MULTIPART.encode('ascii')))
+    assert msg['Subject'] == 'draft'
+    assert not msg.is_parsed
+    assert len(msg.get_payload()) == 2
+
+
+def test_message_datastream_streams_bytes():
+    api = FakeAPI()
+    api.add_datastream('test:1', 'MIME', EIGHT_BIT, mimetype='message/rfc822')
+    obj = EmailMessage(api, 'test:1')
+    # 8-bit content is serialized unchanged, and so has the same checksum
+    assert obj.mime_data._raw_content() == EIGHT_BIT
+    assert obj.mime_data.content._binary
+
+
+class FakeMimeContent(object):
+    # records the thread message data is retrieved in
+    def __init__(self, data, threads):
+        self.data = data
+        self.threads = threads
+
+    def as_bytes(self):
+        self.threads.append(threading.current_thread())
+        if self.data is None:
+            raise IOError('unavailable')
+        return self.data
+
+
+class FakeDatastream(object):
+    def __init__(self, content=None):
+        self.content = content
+
+
+class FakeMessage(object):
+    # enough of EmailMessage for Mailbox.update_cerp
+    def __init__(self, pid, data, threads):
+        self.pid = pid
+        self.threads = threads
+        self.mime_data = FakeDatastream(FakeMimeContent(data, threads))
+        self.cerp = FakeDatastream()
+        self.saved = False
+
+    def _set_cerp_hash(self):
+        pass
+
+    def save(self, logMessage=None):
+        self.threads.append(threading.current_thread())
+        self.saved = True
+
+
+def test_mailbox_update_cerp_batches():
+    threads = []
+    messages = [FakeMessage('test:%d' % i, MULTIPART.encode('ascii'), threads)
+                for i in range(5)]
+    messages.append(FakeMessage('test:bad', None, threads))
+    progress = []
+    errors = Mailbox(FakeAPI(), 'test:mbox').update_cerp(
+        messages, processes=1, batch_size=2, save=True,
+        progress=lambda done, total: progress.append((done, total)))
+
+    assert list(errors) == ['test:bad']
+    assert errors['test:bad'].startswith('OSError')
+    assert [p[0] for p in progress] == list(range(1, 7))
+    assert all(total == 6 for done, total in progress)
+    for msg in messages[:5]:
+        assert msg.saved
+        assert msg.cerp.content.subject_list[0] == 'draft'
+    # message data is retrieved and saved in the calling thread, not
+    # in the pool's task handler
+    assert set(threads) == set([threading.current_thread()])
+
+
+def test_mime_checksum_no_content():
+    msg = EmailMessage(FakeAPI())
+    assert msg.mime_checksum() is None
+    assert not msg.cerp_is_current()
+
+
+def test_mime_checksum_from_profile():
+    api = FakeAPI()
+    api.add_datastream('test:1', 'MIME', MULTIPART, mimetype='message/rfc822')
+    msg = EmailMessage(api, 'test:1')
+    assert msg.mime_checksum() == ('MD5', api.objects['test:1']['MIME'].checksum)
+    # content is not retrieved to calculate the checksum
+    assert api.count('getDatastreamDissemination') == 0
+
+
+def test_cerp_is_current():
+    api = FakeAPI()
+    api.add_datastream('test:1', 'MIME', MULTIPART, mimetype='message/rfc822')
+    msg = EmailMessage(api, 'test:1')
+    assert not msg.cerp_is_current()
+    assert msg.update_cerp(dirty_only=True)
+    assert msg.cerp_is_current()
+    assert not msg.update_cerp(dirty_only=True)
+
+    # changed message content makes cerp out of date
+    msg.mime_data.content = LazyEmailMessage.from_string(
+        MULTIPART.replace('draft', 'final'))
+    assert not msg.cerp_is_current()
+    assert msg.update_cerp(dirty_only=True)
+    assert msg.cerp.content.subject_list[0] == 'final'
+
+
+CERP_XML = '''<Message xmlns="http://www.archives.ncdcr.gov/mail-account">
+  <From>author@example.com</From><OrigDate>Mon, 1 Jan 1990 10:00:00 -0500</OrigDate>
+  <Subject>draft</Subject></Message>'''
+
+RIGHTS_XML = '''<rights xmlns="http://pid.emory.edu/ns/2010/rights">
+  <accessStatus code="2">Allowed</accessStatus></rights>'''
+
+
+def test_message_summaries():
+    api = FakeAPI()
+    api.add_datastream('test:1', 'CERP', CERP_XML)
+    api.add_datastream('test:1', 'Rights', RIGHTS_XML)
+    api.add_object('test:2')
+    mailbox = Mailbox(api, 'test:mbox')
+    mailbox._risearch = FakeResourceIndex([
+        {'pid': 'info:fedora/test:1', 'label': 'message 1'},
+        {'pid': 'info:fedora/test:2', 'label': ''}])
+
+    summaries = mailbox.message_summaries()
+    assert len(mailbox.risearch.queries) == 1
+    assert summaries == [
+        MessageSummary('test:1', 'message 1', 'draft',
+                       'Mon, 1 Jan 1990 10:00:00 -0500', 'author@example.com', '2'),
+        MessageSummary('test:2', None, None, None, None, None)]
+    # no object profiles or datastream lists are loaded
+    assert api.count('getObjectProfile') == 0
+    assert api.count('listDatastreams') == 0
+
+
+MODS_XML = '''<mods:mods xmlns:mods="http://www.loc.gov/mods/v3">
+  <mods:titleInfo><mods:title>%s</mods:title></mods:titleInfo></mods:mods>'''
+
+
+def test_arrangement_prefetch():
+    repo = FakeRepository()
+    for i in range(3):
+        repo.api.add_datastream('test:%d' % i, 'Rights', RIGHTS_XML)
+        if i != 2:
+            repo.api.add_datastream('test:%d' % i, 'MODS', MODS_XML % ('item %d' % i))
+
+    objects = Arrangement.prefetch(repo, ['test:0', 'info:fedora/test:1', 'test:2'])
+    assert [obj.pid for obj in objects] == ['test:0', 'test:1', 'test:2']
+    assert all(isinstance(obj, Arrangement) for obj in objects)
+    # one datastream list per object, and content only for datastreams
+    # that exist
+    assert repo.api.count('listDatastreams') == 3
+    assert repo.api.count('getDatastreamDissemination') == 5
+
+    requests = len(repo.api.calls)
+    assert [obj.rights.content.access_status.code for obj in objects] == ['2', '2', '2']
+    assert [obj.mods.content.title for obj in objects] == ['item 0', 'item 1', None]
+    # accessing prefetched datastreams makes no further requests
+    assert len(repo.api.calls) == requests
+    assert not objects[2].mods.exists
+
+
+def test_arrangement_prefetch_filetech():
+    repo = FakeRepository()
+    repo.api.add_datastream('test:1', 'FileMasterTech', filetech_xml(FILES))
+    obj, = Arrangement.prefetch(repo, ['test:1'], datastreams=['filetech'])
+    requests = len(repo.api.calls)
+    assert [f.md5 for f in obj.filetech.content.file] == ['aaa', 'bbb', 'ccc']
+    # prefetched content is used rather than streamed again
+    assert [f.md5 for f in obj.filetech_files()] == ['aaa', 'bbb', 'ccc']
+    assert len(repo.api.calls) == requests
@@ -0,0 +1,88 @@
+from eulfedora.models import DigitalObject
+
+from eulcm.cache import AccessCache
+from eulcm.models.boda import Arrangement
+from eulcm.models.collection.tree import invalidate_collection_tree, \
+     load_collection_tree
+from eulcm.models.collection.v1_1 import Collection
+
+from fakes import FakeAPI, FakeResourceIndex
+from test_xmlmap_boda import rights_xml
+
+
+def collection_with_members(api):
+    api.add_datastream('test:1', 'Rights', rights_xml('2'))
+    api.add_datastream('test:2', 'Rights', rights_xml('8'))
+    api.add_object('test:3')
+    coll = Collection(api, 'test:coll')
+    coll._risearch = FakeResourceIndex(subjects=[
+        'info:fedora/test:1', 'info:fedora/test:2', 'info:fedora/test:3'])
+    return coll
+
+
+def test_member_access():
+    api = FakeAPI()
+    decisions = collection_with_members(api).member_access(['2'])
+    assert sorted(decisions) == ['test:1', 'test:2', 'test:3']
+    assert decisions['test:1'].allowed
+    assert not decisions['test:2'].allowed
+    assert decisions['test:3'].code is None
+    assert not decisions['test:3'].allowed
+    # no profiles are needed without a cache
+    assert api.count('getDatastream') == 0
+
+
+def test_member_access_caches_versions():
+    api = FakeAPI()
+    cache = AccessCache(['2'], ttl=0)
+    collection_with_members(api).member_access(['2'], cache=cache)
+    assert api.count('getDatastreamDissemination') == 2
+    # cached decisions have the datastream version, so expired entries
+    # are revalidated with the profile only
+    assert cache.decision(Arrangement(api, 'test:1')).allowed
+    assert api.count('getDatastreamDissemination') == 2
+
+    api.add_datastream('test:1', 'Rights', rights_xml('8'))
+    assert not cache.decision(Arrangement(api, 'test:1')).allowed
+    assert api.count('getDatastreamDissemination') == 3
+
+
+def tree_results(*relations):
+    return [dict(pid='info:fedora/%s' % pid, label=label,
+                 parent='info:fedora/%s' % parent if parent else None)
+            for pid, parent, label in relations]
+
+
+def test_collection_tree():
+    invalidate_collection_tree()
+    risearch = FakeResourceIndex(tree_results(('test:top', None, 'Top'),
+                                              ('test:sub', 'test:top', 'Sub'),
+                                              ('test:subsub', 'test:sub', 'Subsub')))
+    tree = load_collection_tree(risearch, Collection.COLLECTION_CONTENT_MODEL)
+    assert [node.pid for node in tree.ancestors('test:subsub')] == ['test:top', 'test:sub']
+    assert tree.subtree('test:top') == ['test:top', 'test:sub', 'test:subsub']
+    assert [node.pid for node in tree.roots] == ['test:top']
+    # cached
+    assert load_collection_tree(risearch, Collection.COLLECTION_CONTENT_MODEL) is tree
+    assert len(risearch.queries) == 1
+
+
+def test_collection_tree_per_repository(monkeypatch):
+    invalidate_collection_tree()
+    cmodel = Collection.COLLECTION_CONTENT_MODEL
+    first = FakeResourceIndex(tree_results(('test:a', None, 'A')),
+                              base_url='http://first.example.com/fedora/')
+    second = FakeResourceIndex(tree_results(('test:b', None, 'B')),
+                               base_url='http://second.example.com/fedora/')
+    assert 'test:a' in load_collection_tree(first, cmodel)
+    assert 'test:b' in load_collection_tree(second, cmodel)
+    assert 'test:a' not in load_collection_tree(second, cmodel)
+
+    # saving a collection only discards the tree for its repository
+    monkeypatch.setattr(DigitalObject, 'save', lambda self, *args, **kwargs: True)
+    coll = Collection(FakeAPI(base_url='http://first.example.com/fedora/'), 'test:a')
+    coll.save()
+    load_collection_tree(first, cmodel)
+    load_collection_tree(second, cmodel)
+    assert len(first.queries) == 2
+    assert len(second.queries) == 1
@@ -0,0 +1,85 @@
+from eulfedora.models import DigitalObject
+
+from eulcm.models.boda import Arrangement, EmailMessage, Mailbox, RushdieFile
+from eulcm.models.collection import v1_1
+from eulcm.models.registry import ContentModelRegistry, rels_ext_content_models, \
+     registry
+
+from fakes import FakeAPI, FakeRepository
+
+
+ARRANGEMENT = 'info:fedora/emory-control:Arrangement-1.0'
+EMAIL = 'info:fedora/emory-control:Rushdie-MailboxEntry-1.0'
+RUSHDIE_FILE = 'info:fedora/emory-control:Rushdie-MarblMacFile-1.0'
+
+
+def rels_ext(pid, *content_models):
+    'RELS-EXT RDF/XML content with hasModel relations.'
+    return ('<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" '
+            'xmlns:fedora-model="info:fedora/fedora-system:def/model#">'
+            '<rdf:Description rdf:about="info:fedora/%s">%s</rdf:Description>'
+            '</rdf:RDF>') % (pid, ''.join(
+                '<fedora-model:hasModel rdf:resource="%s"/>' % uri
+                for uri in content_models))
+
+
+def test_rels_ext_content_models():
+    data = rels_ext('test:1', ARRANGEMENT, EMAIL).encode('utf-8')
+    assert rels_ext_content_models(data) == frozenset([ARRANGEMENT, EMAIL])
+
+
+def test_best_class():
+    assert registry.best_class([ARRANGEMENT]) is Arrangement
+    # the class requiring the most content models wins
+    assert registry.best_class([EMAIL, ARRANGEMENT]) is EmailMessage
+    assert registry.best_class([ARRANGEMENT, RUSHDIE_FILE,
+                                'info:fedora/fedora-system:FedoraObject-3.0']) is RushdieFile
+    # all of a class's content models are required
+    assert registry.best_class([EMAIL]) is None
+    assert registry.best_class(v1_1.Collection.CONTENT_MODELS) is v1_1.Collection
+    assert registry.best_class([]) is None
+
+
+def test_best_class_remembers_matches():
+    reg = ContentModelRegistry([Arrangement])
+    assert reg.best_class([ARRANGEMENT, EMAIL]) is Arrangement
+    # registering a class clears remembered matches
+    reg.register(EmailMessage)
+    assert reg.best_class([ARRANGEMENT, EMAIL]) is EmailMessage
+    # only explicitly registered classes are used
+    assert reg.best_class(Mailbox.CONTENT_MODELS) is None
+
+
+def test_best_class_prefers_subclass():
+    class Special(Arrangement):
+        CONTENT_MODELS = [ARRANGEMENT]
+
+    reg = ContentModelRegistry([Special, Arrangement])
+    assert reg.best_class([ARRANGEMENT]) is Special
+
+
+def test_classify():
+    api = FakeAPI()
+    api.add_datastream('test:1', 'RELS-EXT', rels_ext('test:1', ARRANGEMENT, EMAIL))
+    api.add_datastream('test:2', 'RELS-EXT', rels_ext('test:2', ARRANGEMENT))
+    api.add_datastream('test:3', 'RELS-EXT', rels_ext('test:3', 'info:fedora/other:Model'))
+    api.add_object('test:4')
+
+    classes = registry.classify(api, ['info:fedora/test:1', 'test:2', 'test:3', 'test:4'])
+    assert classes == {'test:1': EmailMessage, 'test:2': Arrangement,
+                       'test:3': None, 'test:4': None}
+    # only RELS-EXT is retrieved, once per object
+    assert api.count('getDatastreamDissemination') == 4
+    assert set(call[2] for call in api.calls) == set(['RELS-EXT'])
+    assert api.count('getObjectProfile') == 0
+
+
+def test_get_objects():
+    repo = FakeRepository()
+    repo.api.add_datastream('test:1', 'RELS-EXT', rels_ext('test:1', ARRANGEMENT, RUSHDIE_FILE))
+    repo.api.add_object('test:2')
+
+    objects = registry.get_objects(repo, ['test:1', 'info:fedora/test:2'])
+    assert [obj.pid for obj in objects] == ['test:1', 'test:2']
+    assert type(objects[0]) is RushdieFile
+    assert type(objects[1]) is DigitalObject
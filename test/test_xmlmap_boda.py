@@ -0,0 +1,262 @@
+import datetime
+import gc
+from io import BytesIO
+import threading
+
+from eulxml.xmlmap import load_xmlobject_from_string
+
+from eulcm.xmlmap.boda import DirPart, DirectoryIndex, FileMasterTech, \
+     FileMasterTech_Base, FileRecord, Rights, parse_w3cdtf
+
+
+FS_NS = FileMasterTech.ROOT_NS
+
+
+def filetech_xml(files):
+    '''FileMasterTech document for a list of dictionaries of file
+    fields (xml tag -> value).'''
+    entries = []
+    for f in files:
+        entries.append('<file>%s</file>' % ''.join('<%s>%s</%s>' % (tag, value, tag)
+                                                  for tag, value in f.items()))
+    return ('<document xmlns="%s">%s</document>' % (FS_NS, ''.join(entries))).encode('utf-8')
+
+
+FILES = [
+    {'localId': '1', 'md5': 'aaa', 'computer': 'Performa 5400',
+     'path': '/Hard Disk/Letters/to editor', 'type': 'TEXT', 'creator': 'ttxt'},
+    {'localId': '2', 'md5': 'bbb', 'computer': 'Performa 5400',
+     'path': '/Hard Disk/Letters/to agent'},
+    {'localId': '3', 'md5': 'ccc', 'computer': 'PowerBook',
+     'path': '/Drafts/novel.doc'},
+]
+
+
+def test_iterfiles():
+    files = list(FileMasterTech.iterfiles(BytesIO(filetech_xml(FILES))))
+    assert [f.local_id for f in files] == ['1', '2', '3']
+    assert all(isinstance(f, FileMasterTech_Base) for f in files)
+    assert files[0].md5 == 'aaa'
+    assert files[0].path == '/Hard Disk/Letters/to editor'
+    assert files[0].name() == 'to editor'
+    assert files[2].computer == 'PowerBook'
+
+
+def test_iterfiles_detaches_parsed_elements():
+    # each file element is removed from the partial document as soon as
+    # it is returned, so memory does not grow with the document
+    for f in FileMasterTech.iterfiles(BytesIO(filetech_xml(FILES))):
+        assert f.node.getparent() is None
+        assert f.node.getprevious() is None
+
+
+def test_iterfiles_empty():
+    assert list(FileMasterTech.iterfiles(BytesIO(filetech_xml([])))) == []
+
+
+def test_file_records():
+    filetech = load_xmlobject_from_string(filetech_xml(FILES), FileMasterTech)
+    records = filetech.file_records()
+    assert all(isinstance(r, FileRecord) for r in records)
+    # same values as the xml object fields
+    for record, f in zip(records, filetech.file):
+        for field in FileRecord._fields:
+            assert getattr(record, field) == getattr(f, field)
+    assert records[0].type == 'TEXT'
+    assert records[1].type is None
+    assert records[0].name() == 'to editor'
+    assert records[0].browsable()
+    assert not records[2].browsable()
+
+
+def test_file_record_first_match_wins():
+    xml = '<file xmlns="%s"><md5>first</md5><md5>second</md5></file>' % FS_NS
+    node = load_xmlobject_from_string(xml, FileMasterTech_Base).node
+    assert FileRecord.from_node(node).md5 == 'first'
+
+
+def test_iterfiles_records():
+    records = list(FileMasterTech.iterfiles(BytesIO(filetech_xml(FILES)), records=True))
+    assert [r.md5 for r in records] == ['aaa', 'bbb', 'ccc']
+    assert all(isinstance(r, FileRecord) for r in records)
+
+
+def test_directory_index():
+    filetech = load_xmlobject_from_string(filetech_xml(FILES), FileMasterTech)
+    index = filetech.directory_index()
+    assert sorted(index.computers) == ['Performa 5400', 'PowerBook']
+
+    top = index.lookup('Performa 5400')
+    assert top.file_count == 2
+    assert list(top.dirs) == ['Hard Disk']
+
+    letters = index.lookup('Performa 5400', '/Hard Disk/Letters/')
+    assert letters.name == 'Letters'
+    assert letters.file_count == 2
+    assert [f.md5 for f in letters.files] == ['aaa', 'bbb']
+    # trailing slash is optional
+    assert index.lookup('Performa 5400', '/Hard Disk/Letters') is letters
+
+    dirs, files = index.children('Performa 5400', '/Hard Disk/')
+    assert dirs == ['Letters']
+    assert files == []
+    dirs, files = index.children('PowerBook', '/Drafts/')
+    assert dirs == []
+    assert [f.name() for f in files] == ['novel.doc']
+
+
+def test_directory_index_missing():
+    record = FileRecord('1', None, 'PowerBook', '/a/b', *[None] * 6)
+    index = DirectoryIndex([record])
+    assert index.lookup('Performa 5400') is None
+    assert index.lookup('PowerBook', '/missing/') is None
+    assert index.lookup('PowerBook', '/a/b/') is None
+    assert index.children('PowerBook', '/missing/') == ([], [])
+
+
+def test_directory_index_sizes():
+    index = DirectoryIndex()
+    for i, f in enumerate(load_xmlobject_from_string(filetech_xml(FILES),
+                                                     FileMasterTech).file_records()):
+        index.add(f, size=10 ** i)
+    assert index.lookup('Performa 5400').size == 11
+    assert index.lookup('Performa 5400', '/Hard Disk/Letters/').size == 11
+    assert index.lookup('PowerBook', '/Drafts/').size == 100
+
+
+def test_directory_index_size_function():
+    filetech = load_xmlobject_from_string(filetech_xml(FILES), FileMasterTech)
+    sizes = {'1': 10, '2': 5}
+    index = filetech.directory_index(size=lambda f: sizes.get(f.local_id))
+    assert index.lookup('Performa 5400').size == 15
+    assert index.lookup('PowerBook').size == 0
+    assert filetech.directory_index().lookup('Performa 5400').size == 0
+
+
+def test_directory_index_pathless_files():
+    files = FILES + [{'localId': '4', 'md5': 'ddd', 'computer': 'PowerBook'}]
+    filetech = load_xmlobject_from_string(filetech_xml(files), FileMasterTech)
+    index = filetech.directory_index()
+    assert [f.local_id for f in index.pathless] == ['4']
+    assert index.lookup('PowerBook').file_count == 1
+    assert index.lookup('Performa 5400').file_count == 2
+
+
+def test_directory_index_lookup_dirpart():
+    filetech = load_xmlobject_from_string(filetech_xml(FILES), FileMasterTech)
+    index = filetech.directory_index()
+    letters = DirPart.for_path('Performa 5400', '/Hard Disk/Letters/')
+    assert index.lookup_dirpart(letters) is \
+        index.lookup('Performa 5400', '/Hard Disk/Letters/')
+
+
+def test_dir_parts_without_computer():
+    # a file with no computer has directory parts, as before parts were shared
+    record = FileRecord('1', None, None, '/x/file.txt', *[None] * 6)
+    assert [(p.computer, p.base, p.name) for p in record.dir_parts()] == \
+        [(None, '/', 'x')]
+
+
+def test_dir_parts_shared():
+    records = load_xmlobject_from_string(filetech_xml(FILES), FileMasterTech).file_records()
+    editor, agent = records[0].dir_chain(), records[1].dir_chain()
+    assert [p.path() for p in editor] == ['/Performa 5400/Hard Disk/',
+                                          '/Performa 5400/Hard Disk/Letters/']
+    assert all(a is b for a, b in zip(editor, agent))
+    assert editor[1].parent is editor[0]
+    assert editor[1].chain() == editor
+
+
+def test_dir_parts_released():
+    key = ('Released', '/a/', 'b')
+    part = DirPart.for_path('Released', '/a/b/')
+    assert DirPart._instances.get(key) is part
+    del part
+    gc.collect()
+    # no reference cycle keeps unused instances alive
+    assert DirPart._instances.get(key) is None
+    assert DirPart._instances.get(('Released', '/', 'a')) is None
+
+
+def test_dir_part_concurrent():
+    results = []
+    barrier = threading.Barrier(8)
+
+    def create():
+        barrier.wait()
+        results.append(DirPart.for_path('Concurrent', '/a/b/c/'))
+
+    threads = [threading.Thread(target=create) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(part is results[0] for part in results)
+
+
+def rights_xml(code='2', expiration=None, block=False):
+    'Rights xml with an access code and optional expiration date.'
+    rights = Rights()
+    rights.create_access_status()
+    rights.access_status.code = code
+    if expiration:
+        rights.access_restriction_expiration = expiration
+    if block:
+        rights.block_external_access = True
+    return rights.serialize()
+
+
+def test_parse_w3cdtf():
+    assert parse_w3cdtf('2020-06-15') == datetime.date(2020, 6, 15)
+    assert parse_w3cdtf('2020-06-15T10:00:00Z') == datetime.date(2020, 6, 15)
+    assert parse_w3cdtf('2020') == datetime.date(2020, 1, 1)
+    assert parse_w3cdtf('2020-06') == datetime.date(2020, 6, 1)
+    assert parse_w3cdtf('2020', end=True) == datetime.date(2020, 12, 31)
+    assert parse_w3cdtf('2020-06', end=True) == datetime.date(2020, 6, 30)
+    assert parse_w3cdtf('2020-02', end=True) == datetime.date(2020, 2, 29)
+    assert parse_w3cdtf('2020-06-15', end=True) == datetime.date(2020, 6, 15)
+    for value in (None, '', 'unknown', '2020-13', '2020-02-30'):
+        assert parse_w3cdtf(value) is None
+        assert parse_w3cdtf(value, end=True) is None
+
+
+def test_access_decision():
+    rights = load_xmlobject_from_string(rights_xml('2'), Rights)
+    decision = rights.access_decision(['2'])
+    assert decision.allowed and not decision.blocked
+    assert decision.code == '2'
+    assert decision.expiration is None and not decision.expired
+    assert not rights.access_decision(['8']).allowed
+
+    blocked = load_xmlobject_from_string(rights_xml('2', block=True), Rights)
+    decision = blocked.access_decision(['2'])
+    assert decision.blocked and not decision.allowed
+
+
+def test_access_decision_year_expiration():
+    rights = load_xmlobject_from_string(rights_xml('4', '2020'), Rights)
+    # a restriction through 2020 lasts until the end of the year
+    decision = rights.access_decision(['2'], today=datetime.date(2020, 6, 1))
+    assert decision.expiration == datetime.date(2020, 12, 31)
+    assert not decision.expired
+    assert not rights.access_decision(['2'], today=datetime.date(2020, 12, 31)).expired
+    assert rights.access_decision(['2'], today=datetime.date(2021, 1, 1)).expired
+
+
+def test_access_decision_month_expiration():
+    rights = load_xmlobject_from_string(rights_xml('4', '2020-06'), Rights)
+    assert not rights.access_decision(['2'], today=datetime.date(2020, 6, 1)).expired
+    decision = rights.access_decision(['2'], today=datetime.date(2020, 6, 30))
+    assert decision.expiration == datetime.date(2020, 6, 30)
+    assert not decision.expired
+    decision = rights.access_decision(['2'], today=datetime.date(2020, 7, 1))
+    assert decision.expired
+    # expiration does not by itself allow access
+    assert not decision.allowed
+
+
+def test_access_decision_day_expiration():
+    rights = load_xmlobject_from_string(rights_xml('4', '2020-06-15'), Rights)
+    # restricted through the expiration date
+    assert not rights.access_decision(['2'], today=datetime.date(2020, 6, 15)).expired
+    assert rights.access_decision(['2'], today=datetime.date(2020, 6, 16)).expired
@@ -0,0 +1,124 @@
+from eulxml.xmlmap import load_xmlobject_from_string
+from eulxml.xmlmap.mods import TitleInfo
+
+from eulcm.xmlmap import core
+from eulcm.xmlmap.boda import FileMasterTech, FileMasterTech_Base, Rights
+from eulcm.xmlmap.core import _first_step
+from eulcm.xmlmap.mods import MODS
+
+from test_xmlmap_boda import FILES, filetech_xml, rights_xml
+
+
+def file_metadata():
+    filetech = load_xmlobject_from_string(filetech_xml(FILES[:1]), FileMasterTech)
+    return filetech.file[0]
+
+
+def test_first_step():
+    assert _first_step('mods:identifier[@type="ark"]') == 'mods:identifier'
+    assert _first_step('mods:titleInfo/mods:title') == 'mods:titleInfo'
+    assert _first_step('rt:a[contains(., "x/y")]/rt:b') == 'rt:a'
+    assert _first_step('@code') == '@code'
+    assert _first_step('text()') == 'text()'
+    for xpath in ('/mods:mods', '.', '..', 'a|b', 'child::a', '*', 'string(a)'):
+        assert _first_step(xpath) is None
+
+
+def test_memoized_fields():
+    assert 'md5' in FileMasterTech_Base._memoized_fields
+    assert 'copyright_date' in Rights._memoized_fields
+    # node fields are never memoized
+    assert 'access_status' not in Rights._memoized_fields
+    # inherited eulxml fields are not memoized, and neither are
+    # identifiers that can be modified through the identifiers list
+    assert 'title' not in MODS._memoized_fields
+    assert 'ark' not in MODS._memoized_fields
+
+
+def test_memoized_until_field_set():
+    f = file_metadata()
+    assert f.md5 == 'aaa'
+    f.node.find('{%s}md5' % f.ROOT_NS).text = 'changed'
+    # the value is remembered until invalidated
+    assert f.md5 == 'aaa'
+    f.invalidate_cache()
+    assert f.md5 == 'changed'
+    f.md5 = 'set'
+    assert f.md5 == 'set'
+    del f.md5
+    assert f.md5 is None
+
+
+def test_shared_node_instances():
+    f = file_metadata()
+    other = FileMasterTech_Base(f.node)
+    assert f.md5 == other.md5 == 'aaa'
+    other.md5 = 'bbb'
+    assert f.md5 == 'bbb'
+
+
+def test_subobject_write_invalidates_document():
+    rights = load_xmlobject_from_string(rights_xml('2'), Rights)
+    assert rights.access_status.code == '2'
+    status = rights.access_status
+    rights.access_status.code = '8'
+    assert status.code == '8'
+    assert rights.access_decision(['2']).code == '8'
+
+
+def test_other_documents_keep_memo():
+    f = file_metadata()
+    other = file_metadata()
+    assert f.md5 == 'aaa'
+    memo = f._field_memo()
+    other.md5 = 'changed'
+    assert f._field_memo() is memo
+    f.md5 = 'changed'
+    assert f._field_memo() is not memo
+
+
+def test_document_limit(monkeypatch):
+    monkeypatch.setattr(core, '_MAX_DOCUMENTS', 2)
+    monkeypatch.setattr(core, '_generations', {})
+    files = [file_metadata() for i in range(3)]
+    for f in files:
+        assert f.md5 == 'aaa'
+        f.md5 = 'bbb'
+    assert len(core._generations) <= 2
+    assert [f.md5 for f in files] == ['bbb'] * 3
+
+
+def test_mods_title_through_title_info():
+    mods = MODS()
+    mods.title = 'first'
+    assert mods.title == 'first'
+    mods.title_info.title = 'second'
+    assert mods.title == 'second'
+
+
+def test_mods_title_through_title_info_list():
+    mods = MODS()
+    assert mods.title is None
+    mods.title_info_list.append(TitleInfo(title='appended'))
+    assert mods.title == 'appended'
+
+
+def test_mods_ark_direct_edit():
+    mods = MODS()
+    mods.ark = 'ark:/25593/first'
+    assert mods.ark == 'ark:/25593/first'
+    mods.node.find('{%s}identifier' % MODS.ROOT_NS).text = 'ark:/25593/second'
+    assert mods.ark == 'ark:/25593/second'
+
+
+def test_unmemoized_fields_use_compiled_xpaths():
+    mods = MODS()
+    mods.ark_uri = 'http://pid.emory.edu/ark:/25593/first'
+    assert mods.ark_uri == 'http://pid.emory.edu/ark:/25593/first'
+    assert mods.title is None
+    compiled = set(key[0] for key in core._compiled_xpaths)
+    assert MODS.ark_uri.xpath in compiled
+    assert MODS.title.xpath in compiled
+    # not memoized, so changes through the identifiers list are seen
+    mods.identifiers[0].text = 'http://pid.emory.edu/ark:/25593/second'
+    assert mods.ark_uri == 'http://pid.emory.edu/ark:/25593/second'
@@ -0,0 +1,39 @@
+from eulxml.xmlmap.mods import Identifier
+
+from eulcm.xmlmap.mods import MODS
+
+
+def sample_mods():
+    mods = MODS()
+    mods.ark = 'ark:/25593/abc'
+    mods.ark_uri = 'http://pid.emory.edu/ark:/25593/abc'
+    mods.source_id = 12
+    mods.identifiers.append(Identifier(type='local', text='first'))
+    mods.identifiers.append(Identifier(type='local', text='second'))
+    mods.identifiers.append(Identifier(text='untyped'))
+    return mods
+
+
+def test_identifiers_list_field():
+    # the eulxml identifiers list field is available on eulcm MODS
+    mods = MODS()
+    mods.identifiers.append(Identifier(type='ark', text='ark:/25593/abc'))
+    assert len(mods.identifiers) == 1
+    assert mods.ark == 'ark:/25593/abc'
+
+
+def test_typed_identifiers():
+    ids = sample_mods().typed_identifiers()
+    assert ids == {
+        'ark': ['ark:/25593/abc'],
+        'uri': ['http://pid.emory.edu/ark:/25593/abc'],
+        'local_source_id': ['12'],
+        'local': ['first', 'second'],
+    }
+
+
+def test_bulk_typed_identifiers():
+    mods = sample_mods()
+    results = MODS.bulk_typed_identifiers([mods, mods.node, mods.serialize(), MODS()])
+    assert results[0] == results[1] == results[2] == mods.typed_identifiers()
+    assert results[3] == {}